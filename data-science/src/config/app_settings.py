@@ -13,6 +13,11 @@ class AppSettings(BaseSettings):
     PORT: int = 0000
     ROOT: str = ""
 
+    UPLOADS_DIR: str = "static/runs/uploads"
+    SOURCE_RESOLVER: str = "yt_dlp"  # or "local" to open source URLs as they are
+    RESOLVER_CACHE_PATH: str = "static/runs/resolved_sources.json"
+    OFFLINE_WORKERS: int = 4
+
     model_config = SettingsConfigDict(env_file="../../.env", extra="ignore")
 
     @model_validator(mode="after")
@@ -7,4 +7,8 @@ class DBSettings(BaseSettings):
     IVS_SERVICE_DB_USER: str = ""
     IVS_SERVICE_DB_PASS: str = ""
 
+    FRAME_STORE_DIR: str = "static/runs/frames"
+    FRAME_STORE_SEGMENT_SIZE: int = 256 * 1024 * 1024
+    FRAME_STORE_MAX_SEGMENTS: int = 64  # oldest segments are deleted past it, 0 keeps them all
+
     model_config = SettingsConfigDict(env_file="../../.env", extra="ignore")
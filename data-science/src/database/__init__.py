@@ -2,8 +2,11 @@ from config import db_settings as dbs
 from .db_control import DBControl
 from .kafka_consumer import KafkaConsumerService
 from .kafka_producer import KafkaProducerService
+from .frame_store import FrameStore
+from .persistence_policy import FramePersistencePolicy
 
 
-db_controller = DBControl(dbs)
+frame_store = FrameStore(dbs.FRAME_STORE_DIR, dbs.FRAME_STORE_SEGMENT_SIZE, dbs.FRAME_STORE_MAX_SEGMENTS)
+db_controller = DBControl(dbs, frame_store)
 kafka_consumer = KafkaConsumerService(db_controller)
-kafka_producer = KafkaProducerService()
\ No newline at end of file
+kafka_producer = KafkaProducerService(frame_store=frame_store)
\ No newline at end of file
@@ -6,16 +6,23 @@ CREATE TABLE IF NOT EXISTS surveillance (
     timestamp      TIMESTAMPTZ NOT NULL DEFAULT (now() AT TIME ZONE 'UTC'),
     channel_name   TEXT NOT NULL,
     source_name    TEXT NOT NULL,
-    frame          TEXT,
+    frame_ref      TEXT,
     boxes          JSONB,
     masks          JSONB,
     keypoints      JSONB,
-    frame_rate     FLOAT
+    frame_rate     FLOAT,
+    state          TEXT NOT NULL DEFAULT 'live'
 );
 
 -- Convert table to hypertable
 SELECT create_hypertable('surveillance', 'timestamp', if_not_exists => TRUE);
 
+-- Frames live in the local frame store (database/frame_store.py), rows only keep their reference.
+-- Migrate tables created with an inline frame column:
+-- ALTER TABLE surveillance DROP COLUMN frame, ADD COLUMN frame_ref TEXT;
+-- Sources are "live" or "degraded" (reconnecting), migrate older tables with:
+-- ALTER TABLE surveillance ADD COLUMN state TEXT NOT NULL DEFAULT 'live';
+
 -- Indexes for efficient querying
 CREATE INDEX IF NOT EXISTS idx_channel_timestamp ON surveillance(channel_name, timestamp DESC);
 CREATE INDEX IF NOT EXISTS idx_source_timestamp ON surveillance(source_name, timestamp DESC);
@@ -0,0 +1,150 @@
+import mmap
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+
+class FrameStore:
+    """
+    Local content-addressed store for JPEG frames.
+    Frames are appended to segment files (read back through mmap), so Kafka messages and database rows only carry
+    a short reference. A stored reference encodes where its frame lies ("segment:offset:length:digest"), so no index
+    is kept in memory nor replayed on start; only the digests of the newest stored frames are remembered, to store
+    repeated frames once. The oldest segments are deleted past `max_segments`, their frames are then unavailable.
+    The newest frame of every source is also kept in memory under its digest, stored or not, for live views.
+    """
+    def __init__(self, root: str = "static/runs/frames", segment_size: int = 256 * 1024 * 1024, max_segments: int = 64,
+                 max_stored: int = 4096):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+
+        self.maps = dict()           # segment_id -> mmap
+        self.stored = OrderedDict()  # digest -> ref of the newest stored frames
+        self.live = dict()           # (channel_name, source_name) -> (digest, frame) of the newest frame
+        self.max_stored = max_stored
+        self.lock = threading.Lock()
+
+        self.segment_id = 0
+        self.segment_file = None
+        self._load()
+
+    def _path(self, segment_id: int) -> Path:
+        return self.root / f"segment_{segment_id:06d}.bin"
+
+    def _segments(self) -> list:
+        return sorted(int(segment_path.stem.split("_")[-1]) for segment_path in self.root.glob("segment_*.bin"))
+
+    def _load(self):
+        segments = self._segments()
+        self._open_segment(segments[-1] if segments else 1)
+
+    def _open_segment(self, segment_id: int):
+        if self.segment_file:
+            self.segment_file.close()
+
+        self.segment_id = segment_id
+        self.segment_file = open(self._path(segment_id), "ab")
+        self._expire()
+
+    def _expire(self):
+        """Delete the oldest segments past `max_segments`, with what refers to them."""
+        if not self.max_segments:
+            return
+
+        expired = set(self._segments()[:-self.max_segments])
+        for segment_id in expired:
+            segment_map = self.maps.pop(segment_id, None)
+            if segment_map is not None:
+                segment_map.close()
+            self._path(segment_id).unlink(missing_ok=True)
+        if expired:
+            self.stored = OrderedDict((digest, ref) for digest, ref in self.stored.items() if self._location(ref)[0] not in expired)
+            print(f"🧹 Frame store: {len(expired)} expired segments deleted")
+
+    @staticmethod
+    def _location(ref: str):
+        """(segment_id, offset, length, digest) of a stored reference, None for a live (digest only) one."""
+        parts = ref.split(":")
+        if len(parts) != 4:
+            return None
+        return int(parts[0]), int(parts[1]), int(parts[2]), parts[3]
+
+    @staticmethod
+    def _digest(frame: bytes) -> str:
+        return hashlib.blake2b(frame, digest_size=16).hexdigest()
+
+    def put(self, frame: bytes) -> str:
+        """Store a frame (once per content among the newest ones), return its reference."""
+        digest = self._digest(frame)
+        with self.lock:
+            return self.stored.get(digest) or self._write(digest, frame)
+
+    def set_live(self, channel_name: str, source_name: str, frame: bytes) -> str:
+        """Keep a frame in memory as the newest one of its source, return its digest."""
+        digest = self._digest(frame)
+        with self.lock:
+            self.live[(channel_name, source_name)] = (digest, frame)
+        return digest
+
+    def release_live(self, channel_name: str):
+        """Drop the live frames of a channel, once it ended."""
+        with self.lock:
+            for source in [source for source in self.live.keys() if source[0] == channel_name]:
+                del self.live[source]
+
+    def _write(self, digest: str, frame: bytes) -> str:
+        if self.segment_file.tell() + len(frame) > self.segment_size and self.segment_file.tell():
+            self._open_segment(self.segment_id + 1)
+        offset = self.segment_file.tell()
+        self.segment_file.write(frame)
+        self.segment_file.flush()
+
+        ref = f"{self.segment_id}:{offset}:{len(frame)}:{digest}"
+        self.stored[digest] = ref
+        while len(self.stored) > self.max_stored:
+            self.stored.popitem(last=False)
+        return ref
+
+    def live_ref(self, channel_name: str, source_name: str) -> str:
+        """Reference of the newest frame of a source."""
+        live = self.live.get((channel_name, source_name))
+        return live[0] if live else None
+
+    def get(self, ref: str) -> bytes:
+        """Read a frame by its reference, None if it is unknown, expired or damaged."""
+        location = self._location(ref)
+        if location is None:
+            with self.lock:
+                return next((frame for digest, frame in self.live.values() if digest == ref), None)
+
+        segment_id, offset, length, digest = location
+        with self.lock:
+            segment_map = self.maps.get(segment_id)
+            # The active segment keeps growing, so remap it when the frame lies past the mapped end
+            if segment_map is None or len(segment_map) < offset + length:
+                if segment_map is not None:
+                    segment_map.close()
+                try:
+                    with open(self._path(segment_id), "rb") as segment_file:
+                        segment_map = self.maps[segment_id] = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+                except (FileNotFoundError, ValueError):
+                    # Expired segment, or an empty one
+                    self.maps.pop(segment_id, None)
+                    return None
+            frame = segment_map[offset:offset + length] if len(segment_map) >= offset + length else None
+
+        # A reused segment id or a truncated file must not hand back another frame
+        if frame is None or self._digest(frame) != digest:
+            print(f"⚠️ Frame store: frame {ref} is damaged or was overwritten")
+            return None
+        return frame
+
+    def close(self):
+        with self.lock:
+            for segment_map in self.maps.values():
+                segment_map.close()
+            self.maps.clear()
+            self.segment_file.close()
@@ -1,7 +1,7 @@
-import json
 import asyncio
 from aiokafka import AIOKafkaConsumer
 from config import kafka_settings as kfs
+from .message_codec import unpack_message
 
 class KafkaConsumerService:
     def __init__(self, db_controller):
@@ -18,7 +18,7 @@ class KafkaConsumerService:
             kfs.KAFKA_TOPIC,
             bootstrap_servers=kfs.KAFKA_BROKER,
             group_id='ivs-consumers',
-            value_deserializer=lambda m: json.loads(m.decode('utf-8')),
+            value_deserializer=unpack_message,
             auto_offset_reset='latest',
             enable_auto_commit=True,
             session_timeout_ms=60000,
@@ -1,18 +1,22 @@
-import json
+import asyncio
+from time import time as curr_time
 from aiokafka import AIOKafkaProducer
 from config import kafka_settings as kfs
+from .message_codec import pack_message
 
 
 class KafkaProducerService:
-    def __init__(self, kafka_topic=kfs.KAFKA_TOPIC, bootstrap_servers=kfs.KAFKA_BROKER):
+    def __init__(self, kafka_topic=kfs.KAFKA_TOPIC, bootstrap_servers=kfs.KAFKA_BROKER, frame_store=None):
         self._producer: AIOKafkaProducer = None
+        self.frame_store = frame_store
+        self.policies = dict()
         self.kafka_topic = kafka_topic
         self.bootstrap_servers = bootstrap_servers
 
     async def start(self):
         self._producer = AIOKafkaProducer(
             bootstrap_servers=self.bootstrap_servers,
-            value_serializer=lambda v: json.dumps(v).encode("utf-8")
+            value_serializer=pack_message
         )
         await self._producer.start()
         print("✅ AIOKafkaProducer started")
@@ -22,10 +26,38 @@ class KafkaProducerService:
             await self._producer.stop()
             print("🛑 AIOKafkaProducer stopped")
 
+    def set_persistence_policy(self, channel_name: str, policy=None):
+        """Frames of a channel without a policy are all persisted."""
+        if policy is None:
+            self.policies.pop(channel_name, None)
+        else:
+            self.policies[channel_name] = policy
+
+    def store_frames(self, channel_name: str, data: list) -> list:
+        """
+        Write the frames the channel policy keeps to the frame store before sending, messages only carry their
+        `frame_ref`, so any consumer resolves them. The other frames are only kept as the newest frame of their source.
+        """
+        policy = self.policies.get(channel_name)
+        timestamp = curr_time()
+        stored = []
+        for item in data:
+            item = dict(item)
+            frame = item.pop("frame", None)
+            if frame:
+                self.frame_store.set_live(channel_name, item["source_name"], frame)
+            keep = frame and (policy is None or policy.should_persist(item, timestamp))
+            item["frame_ref"] = self.frame_store.put(frame) if keep else None
+            stored.append(item)
+        return stored
+
     async def push(self, channel_name: str, data: list):
         if not self._producer:
             raise RuntimeError("Kafka producer is not initialized. Call `start()` first.")
 
+        if self.frame_store:
+            data = await asyncio.to_thread(self.store_frames, channel_name, data)
+
         message = {
             "channel_name": channel_name,
             "data": data
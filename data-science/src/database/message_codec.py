@@ -0,0 +1,59 @@
+import json
+import base64
+import struct
+
+# Message layout: [4 bytes header length][JSON header][raw blobs...]
+# `bytes` values (JPEG frames) are replaced in the JSON body by {"$blob": index} and appended raw after the header.
+HEADER_LENGTH = struct.Struct(">I")
+
+
+def _extract_blobs(value, blobs: list):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        blobs.append(value)
+        return {"$blob": len(blobs) - 1}
+    if isinstance(value, dict):
+        return {key: _extract_blobs(item, blobs) for key, item in value.items()}
+    # Blobs only live in dicts, so lists of plain values (boxes, masks, ...) are not walked
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [_extract_blobs(item, blobs) for item in value]
+    return value
+
+def _restore_blobs(value, blobs: list):
+    if isinstance(value, dict):
+        if "$blob" in value:
+            return blobs[value["$blob"]]
+        return {key: _restore_blobs(item, blobs) for key, item in value.items()}
+    if isinstance(value, list) and value and isinstance(value[0], dict):
+        return [_restore_blobs(item, blobs) for item in value]
+    return value
+
+def pack_message(message) -> bytes:
+    """Serialize a JSON-able message whose `bytes` values travel raw instead of base64."""
+    blobs = []
+    body = _extract_blobs(message, blobs)
+    header = json.dumps({"body": body, "blobs": [len(blob) for blob in blobs]}).encode("utf-8")
+    return b"".join([HEADER_LENGTH.pack(len(header)), header, *blobs])
+
+def unpack_message(payload: bytes):
+    """Inverse of `pack_message`."""
+    payload = memoryview(payload)
+    header_length = HEADER_LENGTH.unpack_from(payload)[0]
+    offset = HEADER_LENGTH.size + header_length
+    header = json.loads(bytes(payload[HEADER_LENGTH.size:offset]))
+
+    blobs = []
+    for length in header["blobs"]:
+        blobs.append(bytes(payload[offset:offset + length]))
+        offset += length
+
+    return _restore_blobs(header["body"], blobs)
+
+def blobs_to_base64(message):
+    """Replace the `bytes` values of a message by base64 strings, for JSON-only consumers."""
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return base64.b64encode(message).decode("utf-8")
+    if isinstance(message, dict):
+        return {key: blobs_to_base64(item) for key, item in message.items()}
+    if isinstance(message, list) and message and isinstance(message[0], dict):
+        return [blobs_to_base64(item) for item in message]
+    return message
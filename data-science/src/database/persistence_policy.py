@@ -0,0 +1,41 @@
+from collections import Counter
+
+
+class FramePersistencePolicy:
+    """
+    Decide which frames of a channel are worth persisting. Detections are always stored, while a source frame is
+    only stored every `interval` seconds, when its detections changed materially since the last stored frame
+    (labels counts changed or new tracks appeared), or when its scene change score reaches `scene_threshold`.
+    """
+    def __init__(self, interval: float = 10.0, detection_change: bool = True, scene_threshold: float = 0.1):
+        assert interval >= 0, ValueError("Interval should be positive")
+        assert 0 <= scene_threshold <= 1, ValueError("Scene threshold should be in range from 0 to 1")
+
+        self.interval = interval
+        self.detection_change = detection_change
+        self.scene_threshold = scene_threshold
+        self.last_persisted = dict()  # source_name -> (timestamp, detections signature)
+
+    @staticmethod
+    def signature(boxes: list):
+        labels = Counter(box[5] for box in boxes)
+        tracks = frozenset(box[6] for box in boxes if box[6] is not None)
+        return labels, tracks
+
+    @staticmethod
+    def changed(previous, current) -> bool:
+        (previous_labels, previous_tracks), (labels, tracks) = previous, current
+        return labels != previous_labels or bool(tracks - previous_tracks)
+
+    def should_persist(self, item: dict, timestamp: float) -> bool:
+        signature = self.signature(item["boxes"])
+        last = self.last_persisted.get(item["source_name"])
+
+        persist = (last is None
+                   or timestamp - last[0] >= self.interval
+                   or (self.detection_change and self.changed(last[1], signature))
+                   or item.get("scene_change", 0) >= self.scene_threshold)
+
+        if persist:
+            self.last_persisted[item["source_name"]] = (timestamp, signature)
+        return persist
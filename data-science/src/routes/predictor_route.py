@@ -3,13 +3,39 @@ from fastapi import Form, UploadFile, File
 from typing import Dict, List, Optional
 import asyncio
 import json
+import shutil
+from pathlib import Path
 
-from services import Predict
+from config import app_settings
+from services import channel_workers, OfflineJob
 from schemas import Channel
-from database import db_controller, kafka_producer
+from database import db_controller, kafka_producer, frame_store, FramePersistencePolicy
+from database.message_codec import pack_message, blobs_to_base64
 
 
 channels: Dict[str, Channel] = {}
+jobs: Dict[str, OfflineJob] = {}
+
+
+def spool_uploads(channel_name: str, names: List[str], files: List[UploadFile]) -> List[str]:
+    """Copy the uploaded sources to disk, so the worker process can open them by path."""
+    directory = Path(app_settings.UPLOADS_DIR) / channel_name
+    directory.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    for name, file in zip(names, files):
+        path = directory / f"{len(paths)}_{Path(file.filename or name).name}"
+        with open(path, "wb") as spooled:
+            shutil.copyfileobj(file.file, spooled)
+        paths.append(str(path))
+    return paths
+
+def job_running(job_name: str) -> bool:
+    """A job runs until its collector is done, the name of a finished (or failed) job can then be reused."""
+    return job_name in jobs.keys() and not jobs[job_name].collector.done()
+
+async def publish(channel_name: str, data: list):
+    await kafka_producer.push(channel_name, data)
 
 
 predictor = APIRouter(
@@ -26,42 +52,74 @@ async def start_channel(channel_name: str = Form(...),
                       files_sources: Optional[List[UploadFile]] = File([]),
                       confidence_threshold: Optional[int] = Form(25), overlapping_threshold: Optional[int] = Form(75),
                       realtime_mode: Optional[bool] = Form(True), augmentation_mode: Optional[bool] = Form(False),
-                      tracking: Optional[bool] = Form(True), reid: Optional[bool] = Form(False)
+                      tracking: Optional[bool] = Form(True), reid: Optional[bool] = Form(False),
+                      tracker_type: Optional[str] = Form(None),
+                      pipeline_mode: Optional[bool] = Form(False), pipeline_queue_size: Optional[int] = Form(2),
+                      capture_mode: Optional[str] = Form("stride"), max_batch_wait: Optional[float] = Form(0.5),
+                      ring_slots: Optional[int] = Form(4), capture_backend: Optional[str] = Form("opencv"),
+                      skip_frames: Optional[str] = Form("default"), decode_size: Optional[int] = Form(None),
+                      send_frames: Optional[bool] = Form(True), frame_quality: Optional[int] = Form(80),
+                      persist_interval: Optional[float] = Form(0), persist_on_change: Optional[bool] = Form(True),
+                      persist_scene_threshold: Optional[float] = Form(0.1),
+                      motion_gate: Optional[bool] = Form(False), motion_threshold: Optional[float] = Form(0.002),
+                      motion_refresh_interval: Optional[float] = Form(2.0),
+                      imgsz: Optional[int] = Form(640), auto_resolution: Optional[bool] = Form(False),
+                      sources_tiles: Optional[str] = Form("{}"), sources_roi: Optional[str] = Form("{}"),
+                      sources_fps: Optional[str] = Form("{}"), sources_deadline: Optional[str] = Form("{}"),
+                      sources_priority: Optional[str] = Form("{}"), deadline: Optional[float] = Form(1.0),
+                      reconnect_delay: Optional[float] = Form(0.5), reconnect_max_delay: Optional[float] = Form(30.0),
+                      worker_group: Optional[str] = Form(None)
                       ):
     try:
         assert channel_name not in channels.keys(), KeyError(f"Channel name '{channel_name}' is already exist!")
 
-        models = {model["name"]: {"task": model["task"], "weight": model["weight"]} for model in json.loads(models)}
+        models = {model["name"]: {"task": model["task"], "weight": model["weight"], "imgsz": model.get("imgsz")} for model in json.loads(models)}
 
         sources_names = json.loads(sources_names)
         urls_sources = json.loads(urls_sources)
-        files_sources = [file.file for file in files_sources]
-
         assert len(sources_names) == len(urls_sources) + len(files_sources), KeyError("Must Upload sources with thier names!")
-        sources = dict(zip(sources_names, urls_sources + files_sources))
-
         assert 0 <= confidence_threshold <= 100, ValueError("Confidence threshold must be in range 0 to 100")
         assert 0 <= overlapping_threshold <= 100, ValueError("Overlapping threshold must be in range 0 to 100")
-        
-        channel = Predict(sources=sources, models=models)
-        channel.configure_inference(
-            confidence_threshold = confidence_threshold / 100,
-            overlapping_threshold = overlapping_threshold / 100,
-            augmentation_mode = augmentation_mode,
-            realtime_mode = realtime_mode
-        )
-        channel.config_tracker(tracking, reid)
-
-        channels[channel_name] = Channel
-        channels[channel_name].object = channel
-
-        async def run_channel():
-            while channels[channel_name].runnig_state:
-                data = channels[channel_name].object.run()
-                await kafka_producer.push(channel_name, data)
-                await asyncio.sleep(0.001)
 
-        channels[channel_name].asyncio_task = asyncio.create_task(run_channel())
+        files_sources = await asyncio.to_thread(spool_uploads, channel_name, sources_names[len(urls_sources):], files_sources)
+        sources = dict(zip(sources_names, urls_sources + files_sources))
+
+        configurations = [
+            ("configure_inference", {
+                "confidence_threshold": confidence_threshold / 100,
+                "overlapping_threshold": overlapping_threshold / 100,
+                "augmentation_mode": augmentation_mode,
+                "realtime_mode": realtime_mode,
+                "max_batch_wait": max_batch_wait,
+            }),
+            ("config_tracker", {"tracking": tracking, "reid": reid, "tracker_type": tracker_type}),
+            ("configure_capture", {"capture_mode": capture_mode, "ring_slots": ring_slots, "capture_backend": capture_backend,
+                                   "skip_frames": skip_frames, "decode_size": decode_size}),
+            ("configure_output", {"send_frames": send_frames, "frame_quality": frame_quality}),
+            ("configure_motion_gate", {"motion_gate": motion_gate, "motion_threshold": motion_threshold, "refresh_interval": motion_refresh_interval}),
+            ("configure_resolution", {"imgsz": imgsz, "auto_resolution": auto_resolution}),
+            ("configure_tiling", {"sources_tiles": json.loads(sources_tiles)}),
+            ("configure_roi", {"sources_roi": json.loads(sources_roi)}),
+            ("configure_scheduler", {"sources_fps": json.loads(sources_fps), "sources_deadline": json.loads(sources_deadline),
+                                     "sources_priority": json.loads(sources_priority), "deadline": deadline}),
+            ("configure_reconnection", {"base_delay": reconnect_delay, "max_delay": reconnect_max_delay}),
+        ]
+
+        # The channel runs in a worker process, shared by the channels of the same group. Models are pooled and batched
+        # across the channels of a worker only: without a group a channel gets its own process (its own core, its own
+        # copy of the models), channels given one `worker_group` share their models but one process
+        worker = channel_workers.acquire(worker_group or channel_name, publish)
+        try:
+            await worker.call("start", channel_name, sources, models, configurations, pipeline_queue_size if pipeline_mode else 0)
+        except Exception:
+            await channel_workers.release(worker, channel_name)
+            raise
+
+        # A zero interval keeps every frame
+        kafka_producer.set_persistence_policy(channel_name, FramePersistencePolicy(persist_interval, persist_on_change, persist_scene_threshold) if persist_interval else None)
+
+        channels[channel_name] = Channel()
+        channels[channel_name].worker = worker
 
         return {"detail": f"Channel '{channel_name}' created and running"}
         
@@ -73,6 +131,7 @@ async def start_channel(channel_name: str = Form(...),
 async def pause_channel(channel_name: str = Form(...)):
     try:
         assert channel_name in channels.keys(), KeyError("Channel name {channel_name} is not exist!")
+        await channels[channel_name].worker.call("pause", channel_name)
         channels[channel_name].runnig_state = False
         return {"detail": f"Channel {channel_name} already paused"}
     except Exception as e:
@@ -83,7 +142,8 @@ async def pause_channel(channel_name: str = Form(...)):
 async def resume_channel(channel_name: str = Form(...)):
     try:
         assert channel_name in channels.keys(), KeyError("Channel name {channel_name} is not exist!")
-        channels[channel_name].state = True
+        await channels[channel_name].worker.call("resume", channel_name)
+        channels[channel_name].runnig_state = True
         return {"detail": f"Channel {channel_name} already resumed"}
     except Exception as e:
         print(e)
@@ -93,8 +153,12 @@ async def resume_channel(channel_name: str = Form(...)):
 async def end_channel(channel_name: str = Form(...)):
     try:
         assert channel_name in channels.keys(), KeyError("Channel name {channel_name} is not exist!")
-        channels[channel_name].asyncio_task.cancel()
-        del channels[channel_name]
+        worker = channels.pop(channel_name).worker
+        await worker.call("end", channel_name)
+        await channel_workers.release(worker, channel_name)
+        shutil.rmtree(Path(app_settings.UPLOADS_DIR) / channel_name, ignore_errors=True)
+        kafka_producer.set_persistence_policy(channel_name, None)
+        frame_store.release_live(channel_name)
         return {"detail": f"Channel {channel_name} already deleted"}
     except Exception as e:
         print(e)
@@ -105,13 +169,117 @@ async def get_channel(channel_name: str = Form(...), start: float = Form(...), e
     try:
         assert channel_name in channels.keys(), KeyError("Channel name {channel_name} is not exist!")
         data = await db_controller.get(channel_name, start, end)
-        return data
+        return blobs_to_base64(data)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@predictor.post("/channel_stats")
+async def channel_stats(channel_name: str = Form(...)):
+    try:
+        assert channel_name in channels.keys(), KeyError("Channel name {channel_name} is not exist!")
+        return await channels[channel_name].worker.call("stats", channel_name)
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@predictor.get("/models_stats")
+async def models_stats():
+    # Models are loaded, and shared, per worker process
+    return {group: await worker.call("models_stats") for group, worker in list(channel_workers.workers.items())}
+
+@predictor.post("/start_job")
+async def start_job(job_name: str = Form(...),
+                    models: Optional[str] = Form([]),
+                    sources_names: Optional[str] = Form([]),
+                    urls_sources: Optional[str] = Form([]),
+                    files_sources: Optional[List[UploadFile]] = File([]),
+                    confidence_threshold: Optional[int] = Form(25), overlapping_threshold: Optional[int] = Form(75),
+                    tracking: Optional[bool] = Form(True), imgsz: Optional[int] = Form(640),
+                    sample_rate: Optional[float] = Form(0), capture_backend: Optional[str] = Form("opencv"),
+                    frame_interval: Optional[float] = Form(1.0), frame_quality: Optional[int] = Form(80),
+                    segments: Optional[int] = Form(1), segment_overlap: Optional[float] = Form(1.0),
+                    start_timestamp: Optional[float] = Form(None)
+                    ):
+    try:
+        assert not job_running(job_name) and job_name not in channels.keys(), KeyError(f"Job name '{job_name}' is already exist!")
+
+        models = {model["name"]: {"task": model["task"], "weight": model["weight"]} for model in json.loads(models)}
+
+        sources_names = json.loads(sources_names)
+        urls_sources = json.loads(urls_sources)
+        assert len(sources_names) == len(urls_sources) + len(files_sources), KeyError("Must Upload sources with thier names!")
+        assert 0 <= confidence_threshold <= 100, ValueError("Confidence threshold must be in range 0 to 100")
+        assert 0 <= overlapping_threshold <= 100, ValueError("Overlapping threshold must be in range 0 to 100")
+
+        files_sources = await asyncio.to_thread(spool_uploads, job_name, sources_names[len(urls_sources):], files_sources)
+        sources = dict(zip(sources_names, urls_sources + files_sources))
+
+        options = {
+            "confidence_threshold": confidence_threshold / 100,
+            "overlapping_threshold": overlapping_threshold / 100,
+            "tracking": tracking,
+            "imgsz": imgsz,
+            "sample_rate": sample_rate,
+            "capture_backend": capture_backend,
+            "frame_interval": frame_interval,
+            "frame_quality": frame_quality,
+            "segments": segments,
+            "segment_overlap": segment_overlap,
+        }
+        job = await asyncio.to_thread(OfflineJob, job_name, sources, models, options, start_timestamp, app_settings.OFFLINE_WORKERS)
+
+        async def collect():
+            try:
+                await job.collect(lambda rows: db_controller.push_bulk(job_name, rows), frame_store.put)
+            finally:
+                shutil.rmtree(Path(app_settings.UPLOADS_DIR) / job_name, ignore_errors=True)
+
+        job.collector = asyncio.create_task(collect())
+        # A finished job stays listed for its progress until its name is reused or it is cancelled
+        jobs[job_name] = job
+
+        return {"detail": f"Job '{job_name}' created and running"}
+
+    except Exception as e:
+        print(e)
+        if not job_running(job_name) and job_name not in channels.keys():
+            shutil.rmtree(Path(app_settings.UPLOADS_DIR) / job_name, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@predictor.post("/job_progress")
+async def job_progress(job_name: str = Form(...)):
+    try:
+        assert job_name in jobs.keys(), KeyError(f"Job name {job_name} is not exist!")
+        return {"finished": jobs[job_name].finished, "sources": jobs[job_name].stats()}
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@predictor.post("/cancel_job")
+async def cancel_job(job_name: str = Form(...)):
+    try:
+        assert job_name in jobs.keys(), KeyError(f"Job name {job_name} is not exist!")
+        job = jobs.pop(job_name)
+        job.cancel()
+        # The collector drains what the processes already sent, then shuts the pool down
+        await job.collector
+        return {"detail": f"Job {job_name} already cancelled"}
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@predictor.post("/get_job")
+async def get_job(job_name: str = Form(...), start: float = Form(...), end: float = Form(...)):
+    try:
+        data = await db_controller.get(job_name, start, end)
+        return blobs_to_base64(data)
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 @predictor.websocket("/connect_channel")
-async def connect_channel(websocket: WebSocket, channel_name: str):
+async def connect_channel(websocket: WebSocket, channel_name: str, binary_frames: bool = False):
     if channel_name not in channels.keys():
         raise HTTPException(status_code=500, detail=f"Channel name {channel_name} is not exist!")
     async def receive():
@@ -137,10 +305,38 @@ async def connect_channel(websocket: WebSocket, channel_name: str):
                 #         channels[channel_name].object.delete_model(name)
                 
                 if 'configure_inference' in user_input.keys():
-                    channels[channel_name].object.configure_inference(**user_input['configure_inference'])
+                    await channels[channel_name].worker.call("configure", channel_name, 'configure_inference', user_input['configure_inference'])
                 
                 if 'configure_tracker' in user_input.keys():
-                    channels[channel_name].object.config_tracker(**user_input['configure_tracker'])
+                    await channels[channel_name].worker.call("configure", channel_name, 'config_tracker', user_input['configure_tracker'])
+
+                if 'configure_capture' in user_input.keys():
+                    await channels[channel_name].worker.call("configure", channel_name, 'configure_capture', user_input['configure_capture'])
+
+                if 'configure_output' in user_input.keys():
+                    await channels[channel_name].worker.call("configure", channel_name, 'configure_output', user_input['configure_output'])
+
+                if 'configure_resolution' in user_input.keys():
+                    await channels[channel_name].worker.call("configure", channel_name, 'configure_resolution', user_input['configure_resolution'])
+
+                if 'configure_roi' in user_input.keys():
+                    await channels[channel_name].worker.call("configure", channel_name, 'configure_roi', user_input['configure_roi'])
+
+                if 'configure_tiling' in user_input.keys():
+                    await channels[channel_name].worker.call("configure", channel_name, 'configure_tiling', user_input['configure_tiling'])
+
+                if 'configure_scheduler' in user_input.keys():
+                    await channels[channel_name].worker.call("configure", channel_name, 'configure_scheduler', user_input['configure_scheduler'])
+
+                if 'configure_reconnection' in user_input.keys():
+                    await channels[channel_name].worker.call("configure", channel_name, 'configure_reconnection', user_input['configure_reconnection'])
+
+                if 'configure_motion_gate' in user_input.keys():
+                    await channels[channel_name].worker.call("configure", channel_name, 'configure_motion_gate', user_input['configure_motion_gate'])
+
+                if 'configure_persistence' in user_input.keys():
+                    policy = user_input['configure_persistence']
+                    kafka_producer.set_persistence_policy(channel_name, FramePersistencePolicy(**policy) if policy else None)
 
                 if 'more_instences' in user_input.keys():
                     channels[channel_name].more_instences = user_input['more_instences']
@@ -153,7 +349,10 @@ async def connect_channel(websocket: WebSocket, channel_name: str):
             while channel_name in channels.keys():
                 if channels[channel_name].runnig_state:
                     pulled_data = await db_controller.pull(channel_name, more_instances=channels[channel_name].more_instences)
-                    await websocket.send_json(pulled_data)
+                    if binary_frames:
+                        await websocket.send_bytes(pack_message(pulled_data))
+                    else:
+                        await websocket.send_json(blobs_to_base64(pulled_data))
                 await asyncio.sleep(0.001)
         except Exception as e:
             pass
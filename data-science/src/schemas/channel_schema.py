@@ -1,9 +1,7 @@
-import asyncio
-from services import Predict
+from services import ChannelWorker
 
 
 class Channel:
-    object: Predict
-    asyncio_task: asyncio.Task
+    worker: ChannelWorker
     runnig_state: bool = True
     more_instences: int = 0
@@ -1 +1,4 @@
-from .inference import Predict
\ No newline at end of file
+def __getattr__(name):
+    # Loaded lazily, so capture processes importing services.inference.capture do not load torch
+    from . import inference
+    return getattr(inference, name)
@@ -0,0 +1,92 @@
+import json
+import numpy as np
+from time import perf_counter
+
+from boxmot.tracker_zoo import create_tracker, get_tracker_config
+from services.inference.tracking import BatchTracker
+
+
+class TrackerBenchmark:
+    """
+    Time the trackers of a channel on recorded detections: the boxmot trackers updated source after source,
+    against the built-in `BatchTracker` updating every source at once.
+    Recordings are the JSON output of `/predictor/get_channel`, or crowded synthetic scenes without one.
+    """
+    def __init__(self, recording_path: str = None, sources: int = 16, objects: int = 60, frames: int = 300, seed: int = 0):
+        self.frames = self.load(recording_path) if recording_path else self.synthesize(sources, objects, frames, seed)
+        self.image = np.zeros((640, 640, 3), dtype=np.uint8)
+        print(f"✅ {len(self.frames)} frames, {max(len(frame) for frame in self.frames)} sources, "
+              f"{np.mean([sum(len(detections) for detections in frame.values()) for frame in self.frames]):.0f} detections per frame")
+
+    @staticmethod
+    def load(recording_path: str) -> list:
+        with open(recording_path) as recording_file:
+            recording = json.load(recording_file)
+
+        labels, frames = dict(), []
+        for instance in sorted(recording, key=lambda instance: instance["timestamp"]):
+            frame = dict()
+            for item in instance["data"]:
+                boxes = [[*box[:5], labels.setdefault(box[5], len(labels))] for box in item["boxes"]]
+                frame[item["source_name"]] = np.array(boxes, dtype=np.float32).reshape(-1, 6)
+            frames.append(frame)
+        return frames
+
+    @staticmethod
+    def synthesize(sources: int, objects: int, frames: int, seed: int) -> list:
+        """Objects walking across the frame with noisy boxes, confidence drops and missed detections."""
+        rng = np.random.default_rng(seed)
+        positions = rng.uniform(0, 600, (sources, objects, 2))
+        velocities = rng.normal(0, 3, (sources, objects, 2))
+        sizes = rng.uniform(20, 60, (sources, objects, 2))
+
+        recording = []
+        for _ in range(frames):
+            positions = (positions + velocities) % 600
+            frame = dict()
+            for source in range(sources):
+                seen = rng.random(objects) > 0.05
+                boxes = np.concatenate([positions[source], positions[source] + sizes[source]], axis=1)[seen]
+                boxes += rng.normal(0, 1, boxes.shape)
+                confidences = np.clip(rng.normal(0.7, 0.2, (len(boxes), 1)), 0.05, 1)
+                frame[f"source {source}"] = np.concatenate([boxes, confidences, np.zeros((len(boxes), 1))], axis=1).astype(np.float32)
+            recording.append(frame)
+        return recording
+
+    def run_boxmot(self, tracker_type: str) -> dict:
+        trackers, durations, ids = dict(), [], set()
+        for frame in self.frames:
+            start = perf_counter()
+            for source_name, detections in frame.items():
+                if source_name not in trackers:
+                    trackers[source_name] = create_tracker(tracker_type=tracker_type, tracker_config=get_tracker_config(tracker_type),
+                                                           reid_weights=None, device="cpu", half=False)
+                if len(detections):
+                    tracks = trackers[source_name].update(detections, self.image)
+                    ids.update((source_name, track_id) for track_id in tracks[:, 4].astype(int).tolist())
+            durations.append(perf_counter() - start)
+        return {"ms_per_frame": round(1000 * float(np.mean(durations)), 2), "tracks": len(ids)}
+
+    def run_batch(self) -> dict:
+        tracker, durations, ids = BatchTracker(), [], set()
+        for frame in self.frames:
+            start = perf_counter()
+            tracks = tracker.update(frame)
+            durations.append(perf_counter() - start)
+            ids.update((source_name, track_id) for source_name, source_tracks in tracks.items() for track_id in source_tracks[:, 4].astype(int).tolist())
+        return {"ms_per_frame": round(1000 * float(np.mean(durations)), 2), "tracks": len(ids)}
+
+    def run(self, tracker_types: list = ("ocsort", "bytetrack")) -> dict:
+        results = {f"boxmot {tracker_type}": self.run_boxmot(tracker_type) for tracker_type in tracker_types}
+        results["numpy batch"] = self.run_batch()
+        for name, result in results.items():
+            print(f"{name:>20}: {result['ms_per_frame']:>8} ms per frame, {result['tracks']} tracks")
+        return results
+
+
+if __name__ == "__main__":
+    # python -m services.benchmark.tracker_benchmark, from src
+    recording_path = None  # "./static/runs/recording.json"
+
+    benchmark = TrackerBenchmark(recording_path, sources=16, objects=60, frames=300)
+    benchmark.run()
@@ -23,7 +23,8 @@ class ExportYolo:
         export_args = {'format': {'gpu_cpu': 'engine', 'cpu_only': 'onnx', 'mobile': 'torchscript'}.get(mode),
                        'device': 'cpu' if mode == 'mobile' else 2,
                        'nms': True,
-                       'batch': NUM_PATCHES,
+                       'batch': NUM_PATCHES, # maximum batch size when exported with dynamic axes
+                       'dynamic': mode != 'mobile',
                        'task': self.model.task,
                        }
         
@@ -1 +1,16 @@
-from .predictor import Predict
+from importlib import import_module
+
+# Imported on first use: capture processes import this package without loading torch and the models
+EXPORTS = {
+    "Predict": ".predictor",
+    "Pipeline": ".pipeline",
+    "model_pool": ".model_pool",
+    "ChannelWorker": ".worker",
+    "channel_workers": ".worker",
+    "OfflineJob": ".offline",
+}
+
+def __getattr__(name):
+    if name not in EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(import_module(EXPORTS[name], __name__), name)
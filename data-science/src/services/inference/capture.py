@@ -0,0 +1,169 @@
+import cv2
+import threading
+import multiprocessing
+from time import time as curr_time, sleep
+
+from .frame_ring import FrameRing
+from .sources import open_capture, AVCap
+
+
+def pace(capture, paced: bool, start_time: float):
+    """Sleep what is left of a file frame interval, at the rate frames currently come out at (lowered by frame skipping)."""
+    frame_rate = capture.get(cv2.CAP_PROP_FPS) if paced else 0
+    if frame_rate > 0:
+        sleep(max(0, 1 / frame_rate - (curr_time() - start_time)))
+
+
+class LatestFrameReader:
+    """
+    Continuously read a capture in a background thread and keep only the newest frame,
+    so the consumer always gets the most recent frame without grabbing the frames in between.
+    """
+    def __init__(self, capture):
+        self.capture = capture
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.timestamp = None
+        self.alive = True
+
+        # Files are read at their frame rate, live streams as fast as they deliver
+        frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT) if isinstance(capture, (cv2.VideoCapture, AVCap)) else 0
+        self.paced = frame_count > 0
+
+        self.thread = threading.Thread(target=self._reader, daemon=True)
+        self.thread.start()
+
+    def _reader(self):
+        while self.alive:
+            start_time = curr_time()
+            success, frame = self.capture.read()
+
+            with self.condition:
+                if not success:
+                    self.alive = False
+                else:
+                    self.frame = frame
+                    self.sequence += 1
+                    self.timestamp = curr_time()
+                self.condition.notify_all()
+
+            pace(self.capture, self.paced, start_time)
+
+    def latest(self, after: int = 0, timeout: float = None):
+        """Return (sequence, timestamp, frame) of the newest frame, waiting up to `timeout` for one newer than `after`."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > after or not self.alive, timeout=timeout)
+            return self.sequence, self.timestamp, self.frame
+
+    def valid(self, sequence: int) -> bool:
+        """Frames are handed over, never overwritten."""
+        return True
+
+    def get(self, prop):
+        return self.capture.get(prop)
+
+    def stop(self):
+        """Stop the reader thread and hand back the capture, still open."""
+        self.alive = False
+        self.thread.join(timeout=1)
+        return self.capture
+
+    def release(self):
+        self.stop().release()
+
+
+def _capture_process(source: str, capture_options: dict, connection, stopped, finished, slots: int):
+    """Capture process loop: decode the source into a frame ring sized after its first frame."""
+    capture = open_capture(source, **capture_options)
+    success, frame = capture.read()
+    if not success:
+        capture.release()
+        connection.send(None)
+        return
+
+    ring = FrameRing(frame.shape, slots)
+    frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT) if isinstance(capture, (cv2.VideoCapture, AVCap)) else 0
+    frame_rate = capture.get(cv2.CAP_PROP_FPS)
+    connection.send((ring.name, frame.shape, {cv2.CAP_PROP_FPS: frame_rate, cv2.CAP_PROP_FRAME_COUNT: frame_count}))
+
+    try:
+        while success and not stopped.is_set():
+            start_time = curr_time()
+            ring.write(frame, start_time)
+            pace(capture, frame_count > 0, start_time)
+            success, frame = capture.read()
+    finally:
+        capture.release()
+        finished.set()
+        # Keep the ring until the reader let it go, it may still be reading the last frames
+        while not stopped.wait(timeout=1) and multiprocessing.parent_process().is_alive():
+            pass
+        ring.close()
+
+
+class ProcessFrameReader:
+    """
+    Read a source in its own capture process that decodes into a shared memory `FrameRing`, so decoding scales
+    across cores and frames reach the inference process without being pickled. Same interface as
+    `LatestFrameReader`, the frames returned are views into the ring: once consumed (letterboxed), `valid(sequence)`
+    tells whether the capture process overwrote the slot meanwhile, and the frame has to be read again.
+    """
+    def __init__(self, source: str, slots: int = 4, capture_options: dict = None, open_timeout: float = 30):
+        context = multiprocessing.get_context("spawn")
+        connection, child_connection = context.Pipe(duplex=False)
+        self.stopped = context.Event()
+        self.finished = context.Event()
+        self.ring = None
+
+        self.process = context.Process(target=_capture_process, args=(source, capture_options or {}, child_connection, self.stopped, self.finished, slots), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+        try:
+            opened = connection.recv() if connection.poll(open_timeout) else None
+        except EOFError:
+            opened = None
+        connection.close()
+
+        if opened is None:
+            self.release()
+            raise RuntimeError(f"Can't read source {source}")
+
+        name, shape, self.properties = opened
+        self.ring = FrameRing(shape, slots, name=name)
+
+    @property
+    def alive(self) -> bool:
+        return not self.finished.is_set() and self.process.is_alive()
+
+    def latest(self, after: int = 0, timeout: float = None):
+        """Return (sequence, timestamp, frame) of the newest frame, waiting up to `timeout` for one newer than `after`."""
+        deadline = None if timeout is None else curr_time() + timeout
+        while True:
+            frame = self.ring.read()
+            if frame is not None and frame[0] > after:
+                return frame
+            if not self.alive or (deadline is not None and curr_time() >= deadline):
+                return frame or (after, None, None)
+            sleep(0.001)
+
+    def valid(self, sequence: int) -> bool:
+        return self.ring is not None and self.ring.valid(sequence)
+
+    def get(self, prop):
+        return self.properties.get(prop, 0)
+
+    def stop(self):
+        """Stop the capture process, there is no capture to hand back in this process."""
+        self.stopped.set()
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        return None
+
+    def release(self):
+        self.stop()
@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class FrameRing:
+    """
+    Ring of fixed-shape uint8 frame slots in shared memory, written by one capture process and read in place by
+    the inference process, its parent (both share one resource tracker, and only the writer unlinks the ring).
+    The header keeps the newest sequence number, and per slot the sequence number of the frame in it
+    (negated while it is being written) and its capture timestamp.
+    """
+    def __init__(self, shape: tuple, slots: int = 4, name: str = None):
+        assert slots > 1, ValueError("A frame ring needs at least 2 slots")
+
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.owner = name is None
+
+        header_size = 8 * (1 + 2 * slots)
+        size = header_size + slots * int(np.prod(self.shape))
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+
+        self.latest_sequence = np.ndarray((1,), dtype=np.int64, buffer=self.memory.buf, offset=0)
+        self.sequences = np.ndarray((slots,), dtype=np.int64, buffer=self.memory.buf, offset=8)
+        self.timestamps = np.ndarray((slots,), dtype=np.float64, buffer=self.memory.buf, offset=8 * (1 + slots))
+        self.frames = np.ndarray((slots, *self.shape), dtype=np.uint8, buffer=self.memory.buf, offset=header_size)
+
+        if self.owner:
+            self.latest_sequence[0] = 0
+            self.sequences[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def write(self, frame, timestamp: float) -> int:
+        """Copy a frame into the next slot (resized if its shape changed) and publish it, return its sequence number."""
+        sequence = int(self.latest_sequence[0]) + 1
+        slot = sequence % self.slots
+
+        self.sequences[slot] = -sequence
+        if frame.shape == self.shape:
+            self.frames[slot] = frame
+        else:
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=self.frames[slot])
+        self.timestamps[slot] = timestamp
+        self.sequences[slot] = sequence
+        self.latest_sequence[0] = sequence
+        return sequence
+
+    def read(self, sequence: int = None):
+        """(sequence, timestamp, frame view) of a frame, the newest by default, None if its slot was reused meanwhile."""
+        sequence = int(self.latest_sequence[0]) if sequence is None else sequence
+        slot = sequence % self.slots
+        if sequence <= 0 or self.sequences[slot] != sequence:
+            return None
+        return sequence, float(self.timestamps[slot]), self.frames[slot]
+
+    def valid(self, sequence: int) -> bool:
+        """Whether a frame returned by `read` is still in its slot, i.e. the view was not overwritten."""
+        return self.sequences[sequence % self.slots] == sequence
+
+    def close(self):
+        # The numpy views export the shared buffer, they have to go before it can be closed
+        self.latest_sequence = self.sequences = self.timestamps = self.frames = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # Frames still referenced by the reader keep the mapping, it goes away with them
+            pass
+        if self.owner:
+            self.memory.unlink()
@@ -0,0 +1,132 @@
+import threading
+import numpy as np
+from concurrent.futures import Future
+from queue import Queue, Empty
+from time import time as curr_time
+
+from ultralytics import YOLO
+
+from config import NUM_PATCHES
+from .utils import is_dynamic_batch
+
+
+class SharedModel:
+    """
+    A model loaded once per process. Every channel using it submits its frames to the model scheduler,
+    which merges the pending requests into batched calls and routes each result slice back to its caller.
+    """
+    def __init__(self, model_path: str, task: str, max_batch: int = NUM_PATCHES, max_wait: float = 0.005):
+        self.predictor = YOLO(model=model_path, task=task)
+        self.dynamic = is_dynamic_batch(model_path)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.users = 0
+        self.calls = 0
+        self.batched_frames = 0
+
+        self.requests = Queue()
+        self.running = True
+        self.thread = threading.Thread(target=self._scheduler, daemon=True)
+        self.thread.start()
+
+    def predict(self, frames: list, **configurations) -> list:
+        future = Future()
+        self.requests.put((frames, configurations, future))
+        return future.result()
+
+    def stop(self):
+        self.running = False
+        self.thread.join(timeout=1)
+
+    def stats(self) -> dict:
+        return {
+            "users": self.users,
+            "calls": self.calls,
+            "average_batch": round(self.batched_frames / self.calls, 2) if self.calls else 0,
+        }
+
+    def _scheduler(self):
+        while self.running:
+            try:
+                pending = [self.requests.get(timeout=0.1)]
+            except Empty:
+                continue
+
+            # Wait a little for the other channels using this model, unless all of them already submitted
+            size = len(pending[0][0])
+            deadline = curr_time() + self.max_wait
+            while size < self.max_batch and len(pending) < self.users and (remaining := deadline - curr_time()) > 0:
+                try:
+                    pending.append(self.requests.get(timeout=remaining))
+                    size += len(pending[-1][0])
+                except Empty:
+                    break
+
+            # Only requests with the same inference configurations can share a call
+            groups = dict()
+            for request in pending:
+                groups.setdefault(tuple(sorted(request[1].items())), []).append(request)
+
+            for group in groups.values():
+                self._run_group(group)
+
+    def _run_group(self, group: list):
+        frames = [frame for request in group for frame in request[0]]
+        configurations = group[0][1]
+
+        try:
+            results = []
+            for start in range(0, len(frames), self.max_batch):
+                batch = frames[start:start + self.max_batch]
+                # Models exported with a fixed batch size still need the batch padded to max_batch
+                padding = [] if self.dynamic else [np.zeros_like(batch[0])] * (self.max_batch - len(batch))
+                results.extend(self.predictor.predict(source=batch + padding, **configurations)[:len(batch)])
+                self.calls += 1
+                self.batched_frames += len(batch)
+        except Exception as e:
+            for request in group:
+                request[2].set_exception(e)
+            return
+
+        start = 0
+        for request in group:
+            request[2].set_result(results[start:start + len(request[0])])
+            start += len(request[0])
+
+
+class ModelPool:
+    """Process-wide registry that loads each (name, task, weight, format) model once and shares it between channels."""
+    def __init__(self):
+        self.models = dict()
+        self.lock = threading.Lock()
+
+    def acquire(self, name: str, task: str, weight: str, models_format: str) -> SharedModel:
+        key = (name, task, weight, models_format)
+        with self.lock:
+            if key not in self.models:
+                model_path = f"static/models/{models_format}/{name} {task} {weight}.{models_format}"
+                yolo_task = {"detection": "detect", "segmentation": "segment", "estimation": "pose"}.get(task)
+                self.models[key] = SharedModel(model_path, task=yolo_task)
+                print(f"Model {model_path.split('/')[-1]} loaded successfully")
+
+            self.models[key].users += 1
+            return self.models[key]
+
+    def release(self, model: SharedModel):
+        with self.lock:
+            model.users -= 1
+            if model.users > 0:
+                return
+
+            for key, shared_model in list(self.models.items()):
+                if shared_model is model:
+                    del self.models[key]
+                    print(f"Model {' '.join(key[:3])}.{key[3]} unloaded")
+            model.stop()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {f"{' '.join(key[:3])}.{key[3]}": model.stats() for key, model in self.models.items()}
+
+
+model_pool = ModelPool()
@@ -0,0 +1,271 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from queue import Empty
+from time import time as curr_time
+
+from boxmot.tracker_zoo import create_tracker, get_tracker_config
+from .utils import *
+from .sources import open_capture
+from .model_pool import model_pool
+from .segments import keyframe_segments, TrackStitcher
+
+from config import NUM_PATCHES
+
+
+def analyze_file(task: int, source_name: str, path: str, models: dict, options: dict, results, cancelled, segment: tuple = (0, None, None)):
+    """
+    Job process task: analyse every frame of a file (or `sample_rate` frames per second of video) in full batches of
+    consecutive frames, and stream the rows back as ("rows" | "tail" | "progress" | "done" | "error", task, value).
+    With a (start, end, stop) `segment` only its frames are analysed, the rows from `end` to `stop` come as "tail".
+    """
+    predictors = []
+    try:
+        device = get_device()
+        models_format = "onnx" if device == 'cpu' else "engine"
+        for name, parameters in models.items():
+            predictors.append(model_pool.acquire(name, parameters["task"], parameters["weight"], models_format))
+        inference_configurations = {
+            'conf': options["confidence_threshold"],
+            'iou': options["overlapping_threshold"],
+            'agnostic_nms': True,
+            'half': not device == "cpu",
+            'device': device,
+            'verbose': False,
+            'batch': NUM_PATCHES,
+        }
+        tracker = create_tracker(tracker_type="ocsort", tracker_config=get_tracker_config("ocsort"), reid_weights=None,
+                                 device=device, half=not device == "cpu") if options["tracking"] else None
+
+        start, end, stop = segment
+        capture = open_capture(path, backend=options["capture_backend"])
+        frame_rate = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        if start:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        total = (stop or int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)) - start
+        step = max(1, round(frame_rate / options["sample_rate"])) if options["sample_rate"] else 1
+        buffers = LetterboxBuffers(NUM_PATCHES)
+        state = {"labels": None, "last_stored": -np.inf}
+
+        def analyze_batch(batch):
+            images = [frame for _, frame, _ in batch]
+            predictions = [predictor.predict(images, **inference_configurations, imgsz=options["imgsz"] if predictor.dynamic else 640)
+                           for predictor in predictors]
+            if state["labels"] is None:
+                state["labels"] = build_labels([model_predictions[0].names for model_predictions in predictions])
+
+            rows, tail = [], []
+            for position, (index, frame, letterbox) in enumerate(batch):
+                detections, masks, keypoints = [], [], []
+                for model_id, model_predictions in enumerate(predictions):
+                    result = model_predictions[position]
+                    if result.boxes:
+                        detections.append(boxes_to_detections(result.boxes, model_id))
+                    if result.masks:
+                        masks.extend(m.astype(int).tolist() for m in result.masks.xy)
+                    if result.keypoints and result.keypoints.xy.size(1):
+                        keypoints.extend(result.keypoints.xy.cpu().numpy().astype(int).tolist())
+
+                detections = np.concatenate(detections, axis=0) if detections else empty_detections()
+                if len(detections) and tracker:
+                    tracks = tracker.update(detections[:, [0, 1, 2, 3, 4, 6]], frame)
+                    if tracks.any():
+                        detections = tracks_to_detections(tracks, detections)
+
+                video_time = index / frame_rate
+                store = options["frame_interval"] and video_time - state["last_stored"] >= options["frame_interval"]
+                if store:
+                    state["last_stored"] = video_time
+
+                (tail if end and index >= end else rows).append({
+                    "source_name": source_name,
+                    "video_time": video_time,
+                    "frame": encode_frame(frame, options["frame_quality"]) if store else None,
+                    "boxes": format_detections(detections, *state["labels"]),
+                    "masks": masks,
+                    "keypoints": keypoints,
+                    "frame_rate": round(frame_rate / step, 2),
+                })
+
+            if rows:
+                results.put(("rows", task, rows))
+            if tail:
+                results.put(("tail", task, tail))
+            results.put(("progress", task, (batch[-1][0] + 1 - start, total)))
+
+        results.put(("progress", task, (0, total)))
+        index, batch = start, []
+        try:
+            while not cancelled.is_set() and (stop is None or index < stop):
+                # Frames between samples are only grabbed, never decoded to pixels
+                if index % step:
+                    success, frame = capture.grab(), None
+                else:
+                    success, frame = capture.read()
+                if not success:
+                    break
+
+                if frame is not None:
+                    batch.append((index, *buffers.letterbox(frame)))
+                index += 1
+
+                if len(batch) == NUM_PATCHES:
+                    analyze_batch(batch)
+                    batch = []
+
+            if batch and not cancelled.is_set():
+                analyze_batch(batch)
+        finally:
+            capture.release()
+
+        results.put(("done", task, index - start))
+    except Exception as e:
+        results.put(("error", task, f"{type(e).__name__}: {e}"))
+    finally:
+        # The pool process runs other tasks next, the models of this one are not kept loaded
+        for predictor in predictors:
+            model_pool.release(predictor)
+
+
+class OfflineJob:
+    """
+    Offline analysis of video files at full speed: no realtime striding, every file is read frame after frame by a
+    process of a pool and inferred in full batches. With `segments` > 1 a long file is split at keyframes into segments
+    analysed in parallel, their tracks stitched back into one ID space (see `TrackStitcher`). Rows are timestamped from
+    `start_timestamp` plus their time in the video, and handed in bulk to the `write(rows)` coroutine given to `collect`.
+    """
+    def __init__(self, name: str, sources: dict, models: dict, options: dict, start_timestamp: float = None, max_workers: int = 4):
+        assert 0 < len(sources), ValueError("There must be at least one file to analyse")
+        assert 0 < len(models), ValueError("There must be at least one model")
+        assert 0 <= options["sample_rate"], ValueError("Sample rate should be positive")
+        assert 0 < options.get("segments", 1), ValueError("Segments should be at least 1")
+
+        context = multiprocessing.get_context("spawn")
+        self.name = name
+        self.start_timestamp = curr_time() if start_timestamp is None else start_timestamp
+        self.manager = context.Manager()
+        self.results = self.manager.Queue(maxsize=64)
+        self.cancelled = self.manager.Event()
+
+        # One task per segment of every file, tracks only need an overlap to be stitched
+        overlap = options.get("segment_overlap", 1.0) if options["tracking"] else 0
+        self.tasks, self.stitchers = dict(), dict()
+        for source_name, path in sources.items():
+            segments = keyframe_segments(path, options.get("segments", 1), overlap)
+            if len(segments) > 1:
+                self.stitchers[source_name] = TrackStitcher(len(segments))
+            for segment_id, segment in enumerate(segments):
+                self.tasks[len(self.tasks)] = {"source_name": source_name, "path": path, "segment_id": segment_id, "segment": segment,
+                                               "state": "queued", "frames": 0, "total": 0, "started": None, "finished": None}
+
+        self.executor = ProcessPoolExecutor(max_workers=min(max_workers, len(self.tasks)), mp_context=context)
+        self.futures = {task: self.executor.submit(analyze_file, task, progress["source_name"], progress["path"], models, options,
+                                                   self.results, self.cancelled, progress["segment"])
+                        for task, progress in self.tasks.items()}
+        self.collector = None
+
+    async def collect(self, write, store=None):
+        """
+        Consume the rows and progress of the job processes until every file is done. Rows a stitcher holds keep no
+        frame bytes: `store(frame) -> frame_ref` writes their frames out first (tail rows are only matched, and drop theirs).
+        """
+        remaining = set(self.tasks.keys())
+        while remaining:
+            try:
+                kind, task, value = await asyncio.to_thread(self.results.get, True, 0.1)
+            except Empty:
+                # Tasks report their own errors, a raised future means its process died
+                for task in list(remaining):
+                    future = self.futures[task]
+                    if future.cancelled():
+                        await self._finish(task, "cancelled", write)
+                    elif future.done() and future.exception():
+                        await self._finish(task, f"error: {future.exception()}", write)
+                    else:
+                        continue
+                    remaining.discard(task)
+                continue
+
+            progress = self.tasks[task]
+            if kind in ("rows", "tail"):
+                stitcher = self.stitchers.get(progress["source_name"])
+                if stitcher:
+                    value = await asyncio.to_thread(self._hold, value, kind == "tail", store)
+                await self._write(stitcher.push(progress["segment_id"], value, tail=kind == "tail") if stitcher else value, write)
+            elif kind == "progress":
+                progress["frames"], progress["total"] = value
+                progress["state"] = "running"
+                progress["started"] = progress["started"] or curr_time()
+            else:
+                if kind == "done":
+                    await self._finish(task, "cancelled" if self.cancelled.is_set() else "done", write)
+                else:
+                    await self._finish(task, f"error: {value}", write)
+                remaining.discard(task)
+
+        await asyncio.to_thread(self.shutdown)
+
+    @staticmethod
+    def _hold(rows: list, tail: bool, store) -> list:
+        for row in rows:
+            if tail:
+                row.pop("frame", None)
+            elif store and row.get("frame"):
+                row["frame_ref"] = store(row.pop("frame"))
+        return rows
+
+    async def _write(self, rows: list, write):
+        if rows:
+            for row in rows:
+                row["timestamp"] = self.start_timestamp + row.pop("video_time")
+            await write(rows)
+
+    async def _finish(self, task: int, state: str, write):
+        progress = self.tasks[task]
+        progress["state"] = state
+        progress["finished"] = curr_time()
+        print(f"{'✅' if state == 'done' else '❌'} Job {self.name}, {progress['source_name']} segment {progress['segment_id']}: {state}")
+
+        # The end of a segment releases the rows of the next ones
+        stitcher = self.stitchers.get(progress["source_name"])
+        if stitcher:
+            await self._write(stitcher.finish(progress["segment_id"]), write)
+
+    def stats(self) -> dict:
+        stats = dict()
+        for source_name in dict.fromkeys(progress["source_name"] for progress in self.tasks.values()):
+            segments = [progress for progress in self.tasks.values() if progress["source_name"] == source_name]
+            frames = sum(progress["frames"] for progress in segments)
+            total = sum(progress["total"] for progress in segments)
+            started = [progress["started"] for progress in segments if progress["started"]]
+            finished = [progress["finished"] for progress in segments]
+            elapsed = ((max(finished) if all(finished) else curr_time()) - min(started)) if started else 0
+            states = [progress["state"] for progress in segments]
+            if any(state.startswith("error") for state in states):
+                state = next(state for state in states if state.startswith("error"))
+            elif "cancelled" in states or "queued" in states:
+                state = "cancelled" if "cancelled" in states else "running" if started else "queued"
+            else:
+                state = "done" if all(state == "done" for state in states) else "running"
+            stats[source_name] = {
+                "state": state,
+                "segments": len(segments),
+                "frames": frames,
+                "total": total,
+                "progress": round(100 * frames / total, 2) if total else None,
+                "frames_rate": round(frames / elapsed, 2) if elapsed else 0,
+            }
+        return stats
+
+    @property
+    def finished(self) -> bool:
+        return all(progress["finished"] for progress in self.tasks.values())
+
+    def cancel(self):
+        self.cancelled.set()
+        for future in self.futures.values():
+            future.cancel()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.manager.shutdown()
@@ -0,0 +1,116 @@
+import threading
+from queue import Queue, Empty, Full
+from time import time as curr_time
+
+
+class Pipeline:
+    """
+    Run a `Predict` instance as four concurrent stages (capture -> inference -> post-processing -> publishing)
+    connected by bounded queues, so frame N+1 is decoded while frame N is inferred.
+    """
+    stages = ("capture", "inference", "postprocessing", "publishing")
+
+    def __init__(self, predictor, publisher, queue_size: int = 2):
+        assert queue_size > 0, ValueError("Queue size must be at least 1")
+
+        self.predictor = predictor
+        self.publisher = publisher
+        self.queues = {stage: Queue(maxsize=queue_size) for stage in self.stages[1:]}
+        self.stages_time = {stage: 0.0 for stage in self.stages}
+        self.last_output_time = None
+
+        self.running = threading.Event()
+        self.threads = []
+
+        # Frames held by the capture, inference and post-processing stages plus the two queues between them
+        self.predictor.configure_buffers(2 * queue_size + 3)
+
+    def start(self):
+        if self.running.is_set():
+            return
+
+        self.running.set()
+        self.threads = [
+            threading.Thread(target=self._stage_loop, args=("capture", None, self._capture), daemon=True),
+            threading.Thread(target=self._stage_loop, args=("inference", "inference", self._inference), daemon=True),
+            threading.Thread(target=self._stage_loop, args=("postprocessing", "postprocessing", self._postprocessing), daemon=True),
+            threading.Thread(target=self._stage_loop, args=("publishing", "publishing", self._publishing), daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        print("✅ Pipeline started")
+
+    def stop(self):
+        self.running.clear()
+        for thread in self.threads:
+            thread.join(timeout=5)
+        self.threads = []
+        for queue in self.queues.values():
+            while not queue.empty():
+                queue.get_nowait()
+        print("🛑 Pipeline stopped")
+
+    def stats(self) -> dict:
+        return {
+            "queues_depth": {stage: queue.qsize() for stage, queue in self.queues.items()},
+            "queues_size": {stage: queue.maxsize for stage, queue in self.queues.items()},
+            "stages_time": {stage: round(duration, 4) for stage, duration in self.stages_time.items()},
+            "processing_rate": self.predictor.processing_rate,
+            "schedule": self.predictor.schedule_stats(),
+        }
+
+    def _next_stage(self, stage: str):
+        index = self.stages.index(stage) + 1
+        return self.queues[self.stages[index]] if index < len(self.stages) else None
+
+    def _stage_loop(self, stage: str, input_queue: str, work):
+        next_queue = self._next_stage(stage)
+        while self.running.is_set():
+            if input_queue:
+                try:
+                    item = self.queues[input_queue].get(timeout=0.1)
+                except Empty:
+                    continue
+            else:
+                item = None
+
+            start_time = curr_time()
+            try:
+                output = work(item)
+            except Exception as e:
+                print(f"❌ Pipeline {stage} error: {e}")
+                continue
+            self.stages_time[stage] = curr_time() - start_time
+
+            if next_queue is None or output is None:
+                continue
+
+            while self.running.is_set():
+                try:
+                    next_queue.put(output, timeout=0.1)
+                    break
+                except Full:
+                    continue
+
+    def _capture(self, _):
+        frames = self.predictor.load_frames()
+        if not frames:
+            # No source due yet: this stage thread waits for one, unavailable sources are still reported
+            self.predictor.wait_for_sources()
+            return frames if self.predictor.unavailable else None
+        return frames
+
+    def _inference(self, frames):
+        return frames, self.predictor.process_frames(frames)
+
+    def _postprocessing(self, item):
+        data = self.predictor.process_results(*item)
+
+        current_time = curr_time()
+        if self.last_output_time is not None:
+            self.predictor.processing_rate = round(1/max(current_time - self.last_output_time, 1e-6), 2)
+        self.last_output_time = current_time
+        return data
+
+    def _publishing(self, data):
+        self.publisher(data)
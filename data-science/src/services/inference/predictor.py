@@ -1,14 +1,18 @@
 import cv2
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from time import time as curr_time
 
-from ultralytics import YOLO
 from boxmot.tracker_zoo import create_tracker, get_tracker_config
 from .utils import *
+from .sources import open_capture
+from .resolver import source_resolver
+from .capture import LatestFrameReader, ProcessFrameReader
+from .model_pool import model_pool
+from .tracking import BatchTracker
+from .reid import ReidEmbedder
 
-import math
 from pathlib import Path
-import base64
 
 from config import NUM_PATCHES
 
@@ -26,49 +30,112 @@ class Predict:
         
         self.sources = dict()
         self.models = dict()
+        self.labels = None
+        self.reid_embedder = None
+        self.frames_in_flight = 2
+        self.schedule_lock = threading.Lock()
+        self.schedule_condition = threading.Condition(self.schedule_lock)
+        self.sources_executor = ThreadPoolExecutor(max_workers=NUM_PATCHES)
+        self.models_executor = ThreadPoolExecutor(max_workers=self.max_models)
+        self.connect_executor = ThreadPoolExecutor(max_workers=NUM_PATCHES)
 
         self.configure_inference()
         self.config_tracker()
+        self.configure_capture()
+        self.configure_output()
+        self.configure_motion_gate()
+        self.configure_resolution()
+        self.configure_tiling()
+        self.configure_roi()
+        self.configure_scheduler()
+        self.configure_reconnection()
 
-        for name, source in sources.items():
-            self.append_source(name, source)
+        # Sources open concurrently while the models load, the channel runs with the ones ready and attaches the others as they connect
+        try:
+            for name, source in sources.items():
+                self.append_source(name, source)
 
-        for name, parameters in models.items():
-            self.append_model(name, parameters)
+            for name, parameters in models.items():
+                self.append_model(name, parameters)
+        except Exception:
+            self.close()
+            raise
 
-        self.sources_executor = ThreadPoolExecutor(max_workers=NUM_PATCHES)
-        self.models_executor = ThreadPoolExecutor(max_workers=self.max_models)
-   
     def __del__(self):
+        if hasattr(self, "connect_executor"):
+            self.close()
+
+    def close(self):
+        """Stop the executors, close the captures and hand the models back to the pool, the channel can't run anymore."""
         self.models_executor.shutdown(wait=True)
         self.sources_executor.shutdown(wait=True)
-        for source in list(self.sources.values()):
-            source["captures"].release()
+        self.connect_executor.shutdown(wait=False, cancel_futures=True)
+        # Connections still running see their source gone and close their capture themselves
+        with self.schedule_lock:
+            sources, self.sources = list(self.sources.values()), dict()
+        for source in sources:
+            self.release_source(source)
+        models, self.models = list(self.models.values()), dict()
+        for model in models:
+            model_pool.release(model["predictor"])
+
+    def batch_slots(self, sources_tiles: dict = None) -> int:
+        """Batch entries one frame of every source takes, a tiled source takes one per tile."""
+        sources_tiles = {name: source["tiles"] for name, source in self.sources.items()} if sources_tiles is None else sources_tiles
+        return sum(tiles[0] * tiles[1] if (tiles := sources_tiles.get(name)) else 1 for name in self.sources.keys())
 
     def append_source(self, name:str, source:str):
-        assert len(self.sources) < NUM_PATCHES, RuntimeError(f"Can't append this source, maximum is {NUM_PATCHES}")
+        assert self.batch_slots() < NUM_PATCHES, RuntimeError(f"Can't append this source, maximum is {NUM_PATCHES} batch slots")
         assert name not in self.sources.keys(), RuntimeError(f"Source {name}, is already exist. you cant add same source twice")
         
-        cap = youtube_cap(source) if "youtu" in source else ThetaCap(source) if "http" in source else cv2.VideoCapture(source)
         # cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
         self.sources[name] = {
-            "captures": cap,
+            "url": source,
+            "captures": None,
+            "reader": None,
+            "sequence": 0,
+            "buffers": LetterboxBuffers(self.frames_in_flight),
+            "tiles": None,
+            "tile_buffers": None,
+            "roi": None,
+            "thumbnail": None,
+            "imgsz": self.resolution_configurations["imgsz"],
+            "resolution_votes": 0,
+            "last_inference": 0,
+            "last_results": (empty_detections(), [], []),
+            "target_fps": None,
+            "deadline": self.schedule_configurations["deadline"],
+            "priority": 0,
+            "next_due": 0,
+            "last_read": None,
+            "deadline_misses": 0,
+            "state": "connecting",
+            "failures": 0,
+            "retry_at": 0,
+            "reconnecting": False,
+            "open_latency": None,
             "tracker": create_tracker(**self.tracker_configurations) if self.tracker_configurations["tracker_type"] else None,
             "data": {
                 "frame": None,
                 "boxes": [],
                 "masks": [],
                 "keypoints": [],
-                "frame_rate": cap.get(cv2.CAP_PROP_FPS)
+                "scene_change": 1.0,
+                "letterbox": None,
+                "frame_rate": 0,
+                "state": "connecting"
             }
         }
-        print(f"Source {name} added successfully")
+        if "youtu" in source:
+            source_resolver.hold(source)
+        # The connection starts on the next run, once the channel configuration is applied
+        print(f"Source {name} added, connecting")
 
     def delete_source(self, name:str):
         if name not in self.sources.keys():
             raise RuntimeError(f"Source {name} is not exist")
         
-        del self.sources[name]
+        self.release_source(self.sources.pop(name))
 
     def append_model(self, name:str, parameters:dict):
         if len(self.models) >= self.max_models:
@@ -76,27 +143,26 @@ class Predict:
         if name in self.models.keys():
             raise RuntimeError(f"Model {name}, is already exist. you can't add same model twice")
         
-        model_path = f"static/models/{self.models_format}/{name + ' ' + parameters["task"] + ' ' + parameters["weight"]}.{self.models_format}"
-        task = {"detection": "detect", "segmentation": "segment", "estimation": "pose"}.get(parameters["task"])
         self.models[name] = {
             "task": parameters["task"],
             "weight": parameters["weight"],
-            "predictor": YOLO(model=model_path, task=task),
-            "results": None
+            "predictor": model_pool.acquire(name, parameters["task"], parameters["weight"], self.models_format),
+            "imgsz": parameters.get("imgsz"),
         }
-        print(f"Model {model_path.split("/")[-1]} loaded successfully")
 
     def delete_model(self, name:str):
         if name not in self.models.keys():
             raise RuntimeError(f"Model {name} is not exist")
         
-        del self.models[name]
+        model = self.models.pop(name)
+        model_pool.release(model["predictor"])
 
     def configure_inference(self, confidence_threshold: float = 0.25, overlapping_threshold: float = 0.75,
-                            augmentation_mode: bool = True, realtime_mode: bool = True):
+                            augmentation_mode: bool = True, realtime_mode: bool = True, max_batch_wait: float = 0.5):
         
         assert 0 <= confidence_threshold <= 1, ValueError("Confidence should be in range from 0 to 1")
         assert 0 <= overlapping_threshold <= 1, ValueError("iou_for_nms should be in range from 0 to 1")
+        assert 0 <= max_batch_wait, ValueError("Max batch wait should be positive")
         
         self.inference_configurations = {
             'conf': confidence_threshold,
@@ -109,102 +175,635 @@ class Predict:
             'batch': NUM_PATCHES,
         }
         self.realtime_mode = realtime_mode
+        self.max_batch_wait = max_batch_wait
 
-    def config_tracker(self, tracking: bool = True, reid: bool = False):
+    def config_tracker(self, tracking: bool = True, reid: bool = False, tracker_type: str = None):
+        """
+        `tracker_type` is a boxmot tracker, updated per source, or "numpy": the built-in ByteTrack-style `BatchTracker`
+        updating the tracks of every source of the channel at once. By default OCSORT, DeepOCSORT with `reid`.
+        With `reid`, DeepOCSORT and the built-in tracker get their embeddings from one `ReidEmbedder` of the channel,
+        batched over the sources and cached per track, instead of cropping and embedding source by source.
+        """
+        tracker_type = None if not tracking else tracker_type or ("ocsort" if not reid else "deepocsort")
+        reid_weights = Path(f"static/models/reid/osnet_x1_0_market1501.pt")
+        if reid and tracker_type in ("deepocsort", "numpy"):
+            self.reid_embedder = self.reid_embedder or ReidEmbedder(reid_weights, self.device, not self.device == "cpu")
+        else:
+            self.reid_embedder = None
+
+        self.batch_tracker = BatchTracker() if tracker_type == "numpy" else None
+        tracker_type = None if tracker_type == "numpy" else tracker_type
 
-        tracker_type = None if not tracking else "ocsort" if not reid else "deepocsort"
-           
         self.tracker_configurations = {
             "tracker_type": tracker_type,
-            "tracker_config": get_tracker_config(tracker_type),
-            "reid_weights": Path(f"static/models/reid/osnet_x1_0_market1501.pt") if reid else None,
+            "tracker_config": get_tracker_config(tracker_type) if tracker_type else None,
+            "reid_weights": reid_weights if reid else None,
             "device": self.device,
             "half": not self.device == "cpu",
             # "per_class": True,
         }
         
         for source in self.sources.values():
-            source["tracker"] = create_tracker(**self.tracker_configurations) if tracking else None
+            source["tracker"] = create_tracker(**self.tracker_configurations) if tracker_type else None
+
+    def configure_capture(self, capture_mode: str = "stride", ring_slots: int = 4, capture_backend: str = "opencv",
+                          skip_frames: str = "default", decode_size: int = None):
+        """
+        stride: each `run()` grabs and drops the frames a source produced since it was last read before reading one.
+        latest: each source is read continuously by a background thread and `run()` takes the newest frame,
+                sources without a new frame within `max_batch_wait` are left out of the batch.
+        process: like latest, but each source is decoded by its own process into a shared memory ring of
+                 `ring_slots` frames, read in place. Switching a source out of this mode reopens it.
+        Files and RTSP streams are decoded by OpenCV, or by PyAV with the "av" `capture_backend`, which can skip
+        non-reference ("nonref") or non-key ("nonkey") frames at the decoder and decode straight to `decode_size`.
+        Changing the backend options reopens the sources.
+        """
+        assert capture_mode in ("stride", "latest", "process"), ValueError("Capture mode should be stride, latest or process")
+        assert ring_slots > 1, ValueError("Ring slots should be at least 2")
+        assert capture_backend in ("opencv", "av"), ValueError("Capture backend should be opencv or av")
+        assert skip_frames in ("default", "nonref", "nonkey"), ValueError("Skip frames should be default, nonref or nonkey")
+        assert decode_size is None or decode_size >= 32, ValueError("Decode size should be at least 32")
+
+        capture_options = {"backend": capture_backend, "skip_frames": skip_frames, "decode_size": decode_size}
+        reopen = capture_options != getattr(self, "capture_options", capture_options)
+
+        self.capture_mode = capture_mode
+        self.ring_slots = ring_slots
+        self.capture_options = capture_options
+
+        for source in self.sources.values():
+            if reopen:
+                self.close_capture(source)
+            if source["state"] == "live":
+                self.attach_reader(source)
+
+    def close_capture(self, source: dict):
+        reader, capture = source["reader"], source["captures"]
+        if reader:
+            reader.release()
+        # A latest reader releases the capture it reads, any other capture is released here
+        if capture and getattr(reader, "capture", None) is not capture:
+            capture.release()
+        source["reader"] = source["captures"] = None
+
+    def release_source(self, source: dict):
+        """Close a source removed from the channel, its media URL is no longer kept fresh for it."""
+        self.close_capture(source)
+        if "youtu" in source["url"]:
+            source_resolver.release(source["url"])
+
+    def attach_reader(self, source: dict):
+        """Put the reader of a source in line with the capture mode."""
+        reader = source["reader"]
+        if isinstance(reader, LatestFrameReader) and self.capture_mode != "latest":
+            reader.stop()
+            reader = None
+        elif isinstance(reader, ProcessFrameReader) and self.capture_mode != "process":
+            reader.release()
+            reader = None
+
+        if self.capture_mode == "process" and source["captures"]:
+            source["captures"].release()
+            source["captures"] = None
+        elif self.capture_mode != "process" and not source["captures"]:
+            source["captures"] = open_capture(source["url"], **self.capture_options, open_timeout=self.reconnect_configurations["timeout"])
+
+        if reader is None and self.capture_mode != "stride":
+            reader = ProcessFrameReader(source["url"], self.ring_slots, {**self.capture_options, "open_timeout": self.reconnect_configurations["timeout"]},
+                                            open_timeout=2 * self.reconnect_configurations["timeout"]) if self.capture_mode == "process" else LatestFrameReader(source["captures"])
+            source["sequence"] = 0
+        source["reader"] = reader
+
+    def configure_buffers(self, frames_in_flight: int = 2):
+        """Number of letterbox buffers per source, at least the number of frames a source can have in flight at once."""
+        assert frames_in_flight > 0, ValueError("Frames in flight should be at least 1")
+
+        self.frames_in_flight = frames_in_flight
+        for source in self.sources.values():
+            source["buffers"] = LetterboxBuffers(frames_in_flight)
+            if source["tiles"]:
+                source["tile_buffers"] = LetterboxBuffers(frames_in_flight * source["tiles"][0] * source["tiles"][1])
+
+    def configure_tiling(self, sources_tiles: dict = None, tiles_overlap: float = 0.2, tiles_merge_threshold: float = 0.6):
+        """
+        Split the native frames of the given sources ({name: [rows, cols]}) into overlapping tiles inferred in the
+        same batch as the other sources, then merge their boxes with a cross-tile NMS. A tiled source takes
+        rows x cols batch slots, and all sources together can not take more than NUM_PATCHES.
+        """
+        sources_tiles = {name: tuple(tiles) for name, tiles in (sources_tiles or {}).items() if tiles}
+        assert all(name in self.sources.keys() for name in sources_tiles.keys()), KeyError("Tiles are given for unknown sources")
+        assert all(rows > 0 and cols > 0 for rows, cols in sources_tiles.values()), ValueError("Tiles rows and cols should be positive")
+        assert self.batch_slots(sources_tiles) <= NUM_PATCHES, MemoryError(f"Tiles can not take more than {NUM_PATCHES} batch slots at a channel")
+        assert 0 <= tiles_overlap < 1, ValueError("Tiles overlap should be in range from 0 to 1")
+        assert 0 < tiles_merge_threshold <= 1, ValueError("Tiles merge threshold should be in range from 0 to 1")
+
+        self.tiling_configurations = {
+            "overlap": tiles_overlap,
+            "merge_threshold": tiles_merge_threshold,
+        }
+        for name, source in self.sources.items():
+            source["tiles"] = sources_tiles.get(name)
+            source["tile_buffers"] = LetterboxBuffers(self.frames_in_flight * source["tiles"][0] * source["tiles"][1]) if source["tiles"] else None
+
+    def configure_output(self, send_frames: bool = True, frame_quality: int = 80):
+        """Frames are published as raw JPEG bytes, and not encoded at all when `send_frames` is off."""
+        assert 0 < frame_quality <= 100, ValueError("Frame quality should be in range from 1 to 100")
+
+        self.output_configurations = {
+            "send_frames": send_frames,
+            "frame_quality": frame_quality,
+        }
+
+    def configure_roi(self, sources_roi: dict = None):
+        """
+        Region of interest polygons per source ({name: [[x, y], ...]}, normalized to the native frame in [0, 1]).
+        Frames are cropped to the polygon bounding rectangle before batching (the published frame is that crop),
+        and detections whose center falls outside the polygon are dropped.
+        """
+        sources_roi = {name: np.array(polygon, dtype=np.float32) for name, polygon in (sources_roi or {}).items() if polygon}
+        assert all(name in self.sources.keys() for name in sources_roi.keys()), KeyError("ROI are given for unknown sources")
+        assert all(polygon.ndim == 2 and len(polygon) >= 3 and polygon.shape[1] == 2 for polygon in sources_roi.values()), ValueError("ROI should be polygons of at least 3 points")
+        assert all(((0 <= polygon) & (polygon <= 1)).all() for polygon in sources_roi.values()), ValueError("ROI points should be normalized in range from 0 to 1")
+
+        for name, source in self.sources.items():
+            source["roi"] = sources_roi.get(name)
+
+    def configure_resolution(self, imgsz: int = 640, sources_imgsz: dict = None, auto_resolution: bool = False,
+                             min_imgsz: int = 320, max_imgsz: int = 640):
+        """
+        Inference input size, globally or per source (`sources_imgsz`), a model `imgsz` parameter caps it for that model.
+        With `auto_resolution`, every source moves between `min_imgsz` and `max_imgsz` in steps of 32:
+        down while all its objects stay large at the current size, up as soon as small objects (or none) are found.
+        """
+        sizes = [imgsz, min_imgsz, max_imgsz, *(sources_imgsz or {}).values()]
+        assert all(size % 32 == 0 and 0 < size <= 640 for size in sizes), ValueError("Input sizes should be multiples of 32 up to 640")
+        assert min_imgsz <= max_imgsz, ValueError("Minimum input size should not exceed the maximum")
+
+        self.resolution_configurations = {
+            "imgsz": imgsz,
+            "auto_resolution": auto_resolution,
+            "min_imgsz": min_imgsz,
+            "max_imgsz": max_imgsz,
+        }
+        for name, source in self.sources.items():
+            source["imgsz"] = (sources_imgsz or {}).get(name, imgsz)
+            source["resolution_votes"] = 0
+
+    def adapt_resolution(self, source: dict, detections):
+        votes = source["resolution_votes"] + resolution_vote(detections, source["imgsz"])
+        if abs(votes) < 5:
+            source["resolution_votes"] = votes
+            return
+
+        imgsz = source["imgsz"] + 32 * (1 if votes > 0 else -1)
+        source["imgsz"] = min(max(imgsz, self.resolution_configurations["min_imgsz"]), self.resolution_configurations["max_imgsz"])
+        source["resolution_votes"] = 0
+
+    def configure_motion_gate(self, motion_gate: bool = False, motion_threshold: float = 0.002, refresh_interval: float = 2.0):
+        """
+        Skip inference for sources whose frame barely changed since the previous one (fraction of changed thumbnail
+        pixels below `motion_threshold`), carrying their last detections forward, and still infer them every `refresh_interval` seconds.
+        """
+        assert 0 <= motion_threshold <= 1, ValueError("Motion threshold should be in range from 0 to 1")
+        assert refresh_interval >= 0, ValueError("Refresh interval should be positive")
+
+        self.motion_configurations = {
+            "motion_gate": motion_gate,
+            "motion_threshold": motion_threshold,
+            "refresh_interval": refresh_interval,
+        }
+
+    def configure_scheduler(self, sources_fps: dict = None, sources_deadline: dict = None, sources_priority: dict = None,
+                            deadline: float = 1.0):
+        """
+        Analysis rate (`sources_fps`, as fast as possible by default), latency deadline in seconds (`sources_deadline`,
+        `deadline` by default) and priority (`sources_priority`, higher first, 0 by default) per source.
+        Every cycle only the due sources are batched, by priority then earliest deadline, up to a batch capacity driven
+        by the inference time: halved when a batch takes longer than its tightest deadline, grown by one slot otherwise.
+        """
+        sources_fps, sources_deadline, sources_priority = sources_fps or {}, sources_deadline or {}, sources_priority or {}
+        names = {*sources_fps.keys(), *sources_deadline.keys(), *sources_priority.keys()}
+        assert all(name in self.sources.keys() for name in names), KeyError("Schedule is given for unknown sources")
+        assert all(fps is None or fps > 0 for fps in sources_fps.values()), ValueError("Target fps should be positive")
+        assert all(value > 0 for value in [deadline, *sources_deadline.values()]), ValueError("Deadlines should be positive")
+
+        with self.schedule_lock:
+            self.schedule_configurations = {
+                "deadline": deadline,
+                "capacity": float(NUM_PATCHES),
+            }
+            for name, source in self.sources.items():
+                source["target_fps"] = sources_fps.get(name)
+                source["deadline"] = sources_deadline.get(name, deadline)
+                source["priority"] = sources_priority.get(name, 0)
+                source["next_due"] = 0
+
+    def _next_wakeup(self, current_time: float) -> float:
+        # Sources that are not live wake the scheduler up for their next connection attempt,
+        # and the ones connecting right now notify it once they are done
+        wakeups = [source["next_due"] if source["state"] == "live" else source["retry_at"]
+                   for source in self.sources.values() if not source["reconnecting"]]
+        wait = min(wakeups, default=current_time + self.reconnect_configurations["tick"]) - current_time
+        return min(max(wait, 0), self.reconnect_configurations["tick"])
+
+    def next_wakeup(self) -> float:
+        """Seconds until a source is due or has a connection attempt to start (at most a tick), 0 if one has."""
+        with self.schedule_lock:
+            return self._next_wakeup(curr_time())
+
+    def wait_for_sources(self):
+        """
+        Block until a source is due, a connection attempt ends, or a tick passed, then start the due attempts.
+        `run()` itself never waits, so only callers running off the event loop (the pipeline stages, the worker
+        processes) should call this between runs.
+        """
+        with self.schedule_lock:
+            wait = self._next_wakeup(curr_time())
+            if wait > 0:
+                self.schedule_condition.wait(wait)
+        self.supervise_sources()
+
+    def schedule_sources(self) -> list:
+        """Names of the sources that get a batch slot this cycle, none when no source is due yet (it never waits)."""
+        with self.schedule_lock:
+            current_time = curr_time()
+            due = [(name, source) for name, source in self.sources.items() if source["state"] == "live" and source["next_due"] <= current_time]
+            if not due:
+                return []
+
+            # Priority cameras first, then whoever is closest to missing its deadline
+            due.sort(key=lambda item: (-item[1]["priority"], item[1]["next_due"] + item[1]["deadline"]))
+            selected, used = [], 0
+            for name, source in due:
+                slots = source["tiles"][0] * source["tiles"][1] if source["tiles"] else 1
+                if selected and used + slots > self.schedule_configurations["capacity"]:
+                    continue
+                selected.append(name)
+                used += slots
+
+                if source["next_due"] and current_time - source["next_due"] > source["deadline"]:
+                    source["deadline_misses"] += 1
+                period = 1 / source["target_fps"] if source["target_fps"] else 0
+                source["next_due"] = max(source["next_due"] + period, current_time)
+            return selected
+
+    def adapt_capacity(self, names: list, duration: float):
+        """AIMD feedback on the number of batch slots per cycle, from the inference time of the last batch."""
+        with self.schedule_lock:
+            deadlines = [self.sources[name]["deadline"] for name in names if name in self.sources]
+            if not deadlines:
+                return
+            capacity = self.schedule_configurations["capacity"]
+            capacity = capacity / 2 if duration > min(deadlines) else capacity + 1
+            self.schedule_configurations["capacity"] = min(max(capacity, 1.0), float(NUM_PATCHES))
+
+    def schedule_stats(self) -> dict:
+        with self.schedule_lock:
+            return {
+                "capacity": round(self.schedule_configurations["capacity"], 2),
+                "sources": {name: {
+                    "target_fps": source["target_fps"],
+                    "frame_rate": source["data"]["frame_rate"],
+                    "priority": source["priority"],
+                    "deadline_misses": source["deadline_misses"],
+                    "state": source["state"],
+                    "open_latency": source["open_latency"],
+                } for name, source in self.sources.items()},
+            }
+
+    def configure_reconnection(self, base_delay: float = 0.5, max_delay: float = 30.0, timeout: float = 10.0, tick: float = 0.1):
+        """
+        Sources are opened in the background, "connecting" until their first frame arrives. A live source whose read
+        fails is closed and reported as "degraded", then reopened after `base_delay` seconds, doubling the delay after
+        every failed attempt up to `max_delay`. An attempt (open included) fails when no frame arrives within `timeout`.
+        The source keeps its tracker and settings meanwhile, files are still removed once they end.
+        Waiting for sources never lasts more than a `tick`, after which the due attempts are started.
+        """
+        assert 0 < base_delay <= max_delay, ValueError("Base delay should be positive and not exceed the maximum delay")
+        assert timeout > 0, ValueError("Reconnection timeout should be positive")
+        assert tick > 0, ValueError("Tick should be positive")
+
+        self.reconnect_configurations = {
+            "base_delay": base_delay,
+            "max_delay": max_delay,
+            "timeout": timeout,
+            "tick": tick,
+        }
+
+    def reconnect_delay(self, failures: int) -> float:
+        return min(self.reconnect_configurations["base_delay"] * 2 ** max(failures - 1, 0), self.reconnect_configurations["max_delay"])
+
+    @property
+    def unavailable(self) -> list:
+        """Sources still connecting or reconnecting."""
+        return [name for name, source in list(self.sources.items()) if source["state"] != "live"]
+
+    def source_failed(self, name: str, source: dict):
+        """A read failed: files are over and removed, other sources are closed and reconnected later."""
+        self.close_capture(source)
+        if Path(source["url"]).is_file():
+            with self.schedule_lock:
+                self.sources.pop(name, None)
+                self.schedule_condition.notify_all()
+            return
+        if "youtu" in source["url"]:
+            # The media URL may have expired, the reconnection resolves it again
+            source_resolver.invalidate(source["url"])
+
+        with self.schedule_lock:
+            source["state"] = source["data"]["state"] = "degraded"
+            source["failures"] += 1
+            source["retry_at"] = curr_time() + self.reconnect_delay(source["failures"])
+        print(f"⚠️ Source {name} lost, reconnecting in {self.reconnect_delay(source['failures'])}s")
+
+    def connect_source(self, name: str, source: dict):
+        """Open (or reopen) a source and wait for its first frame, the source goes live once it arrives."""
+        start_time = curr_time()
+        try:
+            configuration = (self.capture_mode, self.capture_options)
+            self.attach_reader(source)
+            if source["reader"]:
+                connected = source["reader"].latest(timeout=self.reconnect_configurations["timeout"])[0] > 0
+            else:
+                connected = source["captures"].grab()
+
+            # The capture was reconfigured during the attempt, the source follows before going live
+            if connected and (self.capture_mode, self.capture_options) != configuration:
+                if self.capture_options != configuration[1]:
+                    self.close_capture(source)
+                self.attach_reader(source)
+        except Exception as e:
+            print(f"❌ Source {name} connection failed: {e}")
+            connected = False
+
+        if not connected or self.sources.get(name) is not source:
+            self.close_capture(source)
+        if not connected and "youtu" in source["url"]:
+            source_resolver.invalidate(source["url"])
+        if self.sources.get(name) is not source:
+            return
+        if not connected and Path(source["url"]).is_file():
+            with self.schedule_lock:
+                self.sources.pop(name, None)
+                self.schedule_condition.notify_all()
+            print(f"❌ Source {name} can not be read, removed")
+            return
+
+        with self.schedule_lock:
+            if connected:
+                source["state"] = source["data"]["state"] = "live"
+                source["data"]["frame_rate"] = (source["reader"] or source["captures"]).get(cv2.CAP_PROP_FPS)
+                source["open_latency"] = round(curr_time() - start_time, 3)
+                source["failures"] = 0
+                source["next_due"] = 0
+                source["last_read"] = None
+            else:
+                source["failures"] += 1
+                source["retry_at"] = curr_time() + self.reconnect_delay(source["failures"])
+            source["reconnecting"] = False
+            self.schedule_condition.notify_all()
+
+        if connected:
+            print(f"✅ Source {name} connected in {source['open_latency']}s")
+
+    def supervise_sources(self):
+        """Start the connection attempts that are due, in the background so live sources keep being served."""
+        current_time = curr_time()
+        for name in self.unavailable:
+            source = self.sources.get(name)
+            if source and not source["reconnecting"] and source["retry_at"] <= current_time:
+                source["reconnecting"] = True
+                self.connect_executor.submit(self.connect_source, name, source)
+
+    def load_frames(self) -> dict:
+        frames = dict()
+        self.supervise_sources()
+        scheduled = self.schedule_sources()
+        deadline = curr_time() + self.max_batch_wait
+
+        def frame_loaded(name, source, native_frame):
+            roi = source["roi"]
+            if roi is not None:
+                x1, y1, x2, y2 = roi_rectangle(native_frame.shape, roi)
+                roi = roi * [native_frame.shape[1], native_frame.shape[0]] - [x1, y1]
+                native_frame = native_frame[y1:y2, x1:x2]
+
+            frame, letterbox = source["buffers"].letterbox(native_frame)
+            if roi is not None:
+                roi = transform_points(roi, letterbox)
+
+            tiles = None
+            if source["tiles"]:
+                tiles = []
+                for x, y, width, height in tile_grid(native_frame.shape, *source["tiles"], self.tiling_configurations["overlap"]):
+                    tile, tile_letterbox = source["tile_buffers"].letterbox(native_frame[y:y + height, x:x + width])
+                    tiles.append((tile, tile_transform((x, y), tile_letterbox, letterbox)))
+
+            thumbnail = scene_thumbnail(frame)
+            scene_change = scene_change_score(source["thumbnail"], thumbnail)
+            source["thumbnail"] = thumbnail
+
+            current_time = curr_time()
+            infer = (not self.motion_configurations["motion_gate"]
+                     or scene_change >= self.motion_configurations["motion_threshold"]
+                     or current_time - source["last_inference"] >= self.motion_configurations["refresh_interval"])
+            if infer:
+                source["last_inference"] = current_time
+
+            frames[name] = {"frame": frame, "tiles": tiles, "roi": roi, "letterbox": letterbox, "scene_change": scene_change, "infer": infer, "imgsz": source["imgsz"]}
+
+        def latest_loading(name, source):
+            original_frame_rate = source["reader"].get(cv2.CAP_PROP_FPS)
+            thumbnail = source["thumbnail"]
+            for _ in range(3):
+                sequence, _, frame = source["reader"].latest(after=source["sequence"], timeout=max(0, deadline - curr_time()))
+                if sequence <= source["sequence"]:
+                    break
+                # Ring frames are letterboxed in place, a slot overwritten meanwhile gave a torn frame: the newest is read again
+                frame_loaded(name, source, frame)
+                if source["reader"].valid(sequence):
+                    break
+                del frames[name]
+                source["thumbnail"] = thumbnail
+            if name in frames:
+                source["data"]["frame_rate"] = round(original_frame_rate / (sequence - source["sequence"]), 2)
+                source["sequence"] = sequence
+            elif not source["reader"].alive:
+                self.source_failed(name, source)
 
-    def load_frames(self):
         def single_loading(name, source):
+            if source["reader"]:
+                return latest_loading(name, source)
+
+            # Skip the frames the source produced since it was last read, so every source keeps its own pace
+            current_time = curr_time()
             original_frame_rate = source["captures"].get(cv2.CAP_PROP_FPS)
-            stride = max(1, math.ceil(original_frame_rate / self.processing_rate)) if self.realtime_mode else 1
+            elapsed = current_time - source["last_read"] if source["last_read"] else 0
+            stride = max(1, round(original_frame_rate * elapsed)) if self.realtime_mode else 1
+            source["last_read"] = current_time
             for _ in range(stride-1):
                 if not source["captures"].grab():
-                    source["captures"].release()
-                    del self.sources[name]
+                    self.source_failed(name, source)
                     break
             else:
                 success, frame = source["captures"].read()
                 if success:
-                    source["data"]["frame"] = frame_resize(frame)
+                    frame_loaded(name, source, frame)
                     source["data"]["frame_rate"] = round(original_frame_rate / stride, 2)
                 else:
-                    source["captures"].release()
-                    del self.sources[name]
+                    self.source_failed(name, source)
 
-        futures = [self.sources_executor.submit(single_loading, name, source) for name, source in list(self.sources.items())]
+        futures = [self.sources_executor.submit(single_loading, name, self.sources[name]) for name in scheduled if name in self.sources]
         for future in as_completed(futures):
             future.result()
 
-    def process_frames(self):
-        def single_processing(model, frames):
-            model["results"] = model["predictor"].predict(source=frames, **self.inference_configurations)
+        return frames
 
-        frames = [source["data"]["frame"] for source in self.sources.values()] 
-        frames.extend([np.zeros((640, 640, 3), dtype=np.uint8) for _ in range(NUM_PATCHES - len(self.sources))])
+    def process_frames(self, frames: dict) -> dict:
+        """
+        Infer the frames (or tiles) of every source not skipped by the motion gate, results are {model: {source: [results]}}
+        with one result per tile. Sources are batched per input size, models exported without dynamic axes always run at 640.
+        """
+        def single_processing(model, names):
+            groups = dict()
+            for name in names:
+                imgsz = min(frames[name]["imgsz"], model["imgsz"] or 640) if model["predictor"].dynamic else 640
+                images = [tile for tile, _ in frames[name]["tiles"]] if frames[name]["tiles"] else [frames[name]["frame"]]
+                groups.setdefault(imgsz, []).extend((name, image) for image in images)
 
-        futures = [self.models_executor.submit(single_processing, model, frames) for model in self.models.values()]
-        for future in as_completed(futures):
-            future.result()
+            results = {name: [] for name in names}
+            for imgsz, group in groups.items():
+                predictions = model["predictor"].predict([image for _, image in group], **self.inference_configurations, imgsz=imgsz)
+                for (name, _), prediction in zip(group, predictions):
+                    results[name].append(prediction)
+            return results
+
+        names = [name for name, packet in frames.items() if packet["infer"]]
+        if not names:
+            return {name: dict() for name in self.models.keys()}
 
-    def run(self):
         start_time = curr_time()
-        
-        self.load_frames()
-        self.process_frames()
-
-        def process_models_result_for_source(source_index, source):
-            models_names = []
-            concatenated_boxes, concatenated_masks, concatenated_keypoints = [], [], []
-            for model_index, model in enumerate(self.models.values(), start=1):
-                results = model["results"][source_index]
-                
-                if results.boxes:
-                    boxes = np.array([b.tolist() for b in list(results.boxes.data)])
-                    boxes[:, -1] = [int(f"{model_index}{int(cls)}") for cls in boxes[:, -1]]
-                    concatenated_boxes.append(boxes)
-                
-                if results.masks:
-                    concatenated_masks.extend([m.astype(int).tolist() for m in results.masks.xy])
-                
-                if results.keypoints and results.keypoints.xy.size(1):
-                    concatenated_keypoints.extend([[[int(x), int(y)] for x, y in k.tolist()] for k in results.keypoints.xy])
-                
-                models_names.append(model["predictor"].names)
-
-            if concatenated_boxes:
-                concatenated_boxes = np.concatenate(concatenated_boxes, axis=0)
-                if source["tracker"]:
-                    tracker = source["tracker"].update(concatenated_boxes, source["data"]["frame"])
-                    if tracker.any():
-                        concatenated_boxes = tracker[:, :-1]
-
-                concatenated_boxes = [reformat_box(box, models_names) for box in concatenated_boxes]
-            
-            source["data"]["boxes"] = concatenated_boxes
+        futures = {name: self.models_executor.submit(single_processing, model, names) for name, model in list(self.models.items())}
+        results = {name: future.result() for name, future in futures.items()}
+
+        self.adapt_capacity(names, curr_time() - start_time)
+        return results
+
+    def process_results(self, frames: dict, results: dict) -> list:
+        # Connecting and degraded sources are reported, without detections, until they are live
+        unavailable = [{"source_name": name, **source["data"], "frame": None, "boxes": [], "masks": [], "keypoints": [], "frame_rate": 0}
+                       for name, source in list(self.sources.items()) if source["state"] != "live"]
+
+        inferred = [model_results for model_results in results.values() if model_results]
+        if len(inferred) == len(results) and results:
+            self.labels = build_labels([next(iter(model_results.values()))[0].names for model_results in results.values()])
+        if self.labels is None:
+            return unavailable
+        labels, labels_offsets = self.labels
+
+        def detect_source(name, packet):
+            source = self.sources.get(name)
+            if source is None:
+                return None
+
+            if packet["infer"]:
+                transforms = [transform for _, transform in packet["tiles"]] if packet["tiles"] else [None]
+                concatenated_detections, concatenated_masks, concatenated_keypoints = [], [], []
+                masks_owners, keypoints_owners, rows = [], [], 0
+                for model_id, model_results in enumerate(results.values()):
+                    for result, transform in zip(model_results[name], transforms):
+                        if result.boxes:
+                            concatenated_detections.append(transform_detections(boxes_to_detections(result.boxes, model_id), transform))
+
+                        if result.masks:
+                            concatenated_masks.extend([transform_points(m, transform) for m in result.masks.xy])
+                            masks_owners.extend(range(rows, rows + len(result.masks.xy)))
+
+                        if result.keypoints and result.keypoints.xy.size(1):
+                            concatenated_keypoints.append(transform_points(result.keypoints.xy.cpu().numpy(), transform))
+                            keypoints_owners.extend(range(rows, rows + len(concatenated_keypoints[-1])))
+
+                        rows += len(result.boxes) if result.boxes is not None else 0
+
+                detections = np.concatenate(concatenated_detections, axis=0) if concatenated_detections else empty_detections()
+                concatenated_keypoints = np.concatenate(concatenated_keypoints, axis=0) if concatenated_keypoints else np.empty((0, 0, 2))
+
+                if (packet["tiles"] or packet["roi"] is not None) and len(detections):
+                    # Boxes of neighbour tiles overlap, keep one per object, drop objects outside the ROI,
+                    # along with the masks/keypoints that belong to them
+                    keep = tiles_nms(detections, self.tiling_configurations["merge_threshold"]) if packet["tiles"] else np.arange(len(detections))
+                    if packet["roi"] is not None:
+                        centers = (detections[keep, :2] + detections[keep, 2:4]) / 2
+                        keep = keep[points_in_polygon(centers, packet["roi"])]
+                    kept = set(keep.tolist())
+                    detections = detections[keep]
+                    concatenated_masks = [mask for mask, owner in zip(concatenated_masks, masks_owners) if owner in kept]
+                    concatenated_keypoints = concatenated_keypoints[np.isin(keypoints_owners, keep)]
+
+                concatenated_masks = [m.astype(int).tolist() for m in concatenated_masks]
+                concatenated_keypoints = concatenated_keypoints.astype(int).tolist()
+                source["last_results"] = (detections, concatenated_masks, concatenated_keypoints)
+                if self.resolution_configurations["auto_resolution"]:
+                    self.adapt_resolution(source, detections)
+            else:
+                # Static frame: the previous detections still hold, and keep the tracker predicting
+                detections, concatenated_masks, concatenated_keypoints = source["last_results"]
+            return detections, concatenated_masks, concatenated_keypoints
+
+        def process_models_result_for_source(name, packet, detections, concatenated_masks, concatenated_keypoints, tracks=None):
+            source = self.sources.get(name)
+            if source is None:
+                return None
+
+            if tracks is None and len(detections) and source["tracker"]:
+                if name in embeddings:
+                    # DeepOCSORT embeds the detections it keeps, above its own threshold
+                    keep = detections[:, 4] > source["tracker"].det_thresh
+                    tracks = source["tracker"].update(detections[:, [0, 1, 2, 3, 4, 6]], packet["frame"], embs=embeddings[name][keep])
+                else:
+                    tracks = source["tracker"].update(detections[:, [0, 1, 2, 3, 4, 6]], packet["frame"])
+            if self.reid_embedder and tracks is not None:
+                self.reid_embedder.remember(name, tracks)
+            if tracks is not None and tracks.any():
+                detections = tracks_to_detections(tracks, detections)
+
+            source["data"]["boxes"] = format_detections(detections, labels, labels_offsets)
             source["data"]["masks"] = concatenated_masks
             source["data"]["keypoints"] = concatenated_keypoints
-            source["data"]["frame"] = base64.b64encode(cv2.imencode('.jpg', source["data"]["frame"])[1]).decode('utf-8')
-        
-        futures = [self.sources_executor.submit(process_models_result_for_source, source_index, source) for source_index, source in enumerate(self.sources.values())]
-        for future in as_completed(futures):
-            future.result()
+            source["data"]["scene_change"] = packet["scene_change"]
+            source["data"]["imgsz"] = packet["imgsz"]
+            source["data"]["letterbox"] = [round(packet["letterbox"][0], 6), *packet["letterbox"][1:]]
+            source["data"]["frame"] = encode_frame(packet["frame"], self.output_configurations["frame_quality"]) if self.output_configurations["send_frames"] else None
+            return {"source_name": name, **source["data"]}
+
+        futures = {name: self.sources_executor.submit(detect_source, name, packet) for name, packet in frames.items()}
+        detected = {name: detections for name, future in futures.items() if (detections := future.result()) is not None}
+
+        # ReID embeddings and the built-in tracker run once for every source, between the per source stages
+        embeddings, tracks = dict(), dict()
+        if self.reid_embedder:
+            self.reid_embedder.retain(self.sources.keys())
+            embeddings = self.reid_embedder.embed({name: (detections[:, :4], frames[name]["frame"])
+                                                   for name, (detections, _, _) in detected.items() if len(detections)})
+        if self.batch_tracker:
+            self.batch_tracker.retain(self.sources.keys())
+            tracks = self.batch_tracker.update({name: detections[:, [0, 1, 2, 3, 4, 6]] for name, (detections, _, _) in detected.items()},
+                                               embeddings)
+
+        futures = [self.sources_executor.submit(process_models_result_for_source, name, frames[name], *source_results, tracks.get(name))
+                   for name, source_results in detected.items()]
+        return unavailable + [data for future in futures if (data := future.result()) is not None]
+
+    def run(self):
+        start_time = curr_time()
+
+        frames = self.load_frames()
+        results = self.process_frames(frames)
+        data = self.process_results(frames, results)
 
-        self.processing_rate = round(1/(curr_time() - start_time), 2)
+        self.processing_rate = round(1/max(curr_time() - start_time, 1e-6), 2)
 
-        return [{"source_name": name, **source["data"]} for name, source in self.sources.items()]
+        return data
 
 if __name__ == '__main__':
     test = Predict(sources={
@@ -0,0 +1,103 @@
+import torch
+import numpy as np
+
+from .utils import box_iou
+
+
+class ReidEmbedder:
+    """
+    ReID model shared by the sources of a channel: the crops of every source are embedded in one batched call, and
+    embeddings are cached per track. A detection reuses the embedding of the track it continues (IoU with the track
+    last box over `reuse_iou`) until the box scale or aspect drifts `max_change` away from the embedded one, or the
+    embedding is `max_age` updates old; only the other detections are cropped and embedded.
+    """
+    def __init__(self, weights, device: str, half: bool, reuse_iou: float = 0.7, max_change: float = 0.2, max_age: int = 30, batch_size: int = 64):
+        from boxmot.appearance.reid_auto_backend import ReidAutoBackend
+
+        self.model = ReidAutoBackend(weights=weights, device=device, half=half).model
+        self.reuse_iou = reuse_iou
+        self.max_change = max_change
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.tracks = dict()   # source_name -> {track_id: {"embedding", "box", "size", "age"}}
+        self.pending = dict()  # source_name -> per detection (embeddings, sizes, ages) of the last `embed`
+        self.stats = {"embedded": 0, "reused": 0}
+
+    def _reusable(self, source_name: str, boxes):
+        """Cached track embedding index reused by each detection, -1 where it has to be embedded."""
+        tracks = list(self.tracks.get(source_name, {}).values())
+        reused = np.full(len(boxes), -1)
+        if not tracks or not len(boxes):
+            return reused, tracks
+
+        iou = box_iou(boxes, np.array([track["box"] for track in tracks]))
+        sizes = np.stack([boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1)
+        embedded_sizes = np.array([track["size"] for track in tracks])
+        change = np.abs(sizes[:, None, :] / np.maximum(embedded_sizes[None, :, :], 1e-6) - 1).max(axis=2)
+        ages = np.array([track["age"] for track in tracks])
+        iou[(change > self.max_change) | (ages[None, :] >= self.max_age)] = 0
+
+        # Greedy one to one, best overlap first
+        while iou.size and iou.max() >= self.reuse_iou:
+            detection, track = np.unravel_index(iou.argmax(), iou.shape)
+            reused[detection] = track
+            iou[detection, :] = 0
+            iou[:, track] = 0
+        return reused, tracks
+
+    @torch.no_grad()
+    def _forward(self, crops):
+        features = []
+        for start in range(0, len(crops), self.batch_size):
+            batch = self.model.inference_preprocess(crops[start:start + self.batch_size])
+            features.append(self.model.inference_postprocess(self.model.forward(batch)))
+        features = np.concatenate(features, axis=0)
+        return features / np.linalg.norm(features, axis=-1, keepdims=True)
+
+    def embed(self, requests: dict) -> dict:
+        """Embeddings of the detections of every source, {source_name: (boxes (N, 4), frame)} -> {source_name: (N, D)}."""
+        plans, crops = dict(), []
+        for source_name, (boxes, frame) in requests.items():
+            boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+            reused, tracks = self._reusable(source_name, boxes)
+            missing = np.flatnonzero(reused < 0)
+            if len(missing):
+                crops.append(self.model.get_crops(boxes[missing], frame))
+            plans[source_name] = (boxes, reused, tracks, missing)
+
+        features = self._forward(torch.cat(crops)) if crops else None
+        embeddings, offset = dict(), 0
+        for source_name, (boxes, reused, tracks, missing) in plans.items():
+            source_embeddings = np.zeros((len(boxes), features.shape[1] if features is not None else 0), dtype=np.float32)
+            sizes = np.stack([boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1)
+            ages = np.zeros(len(boxes), dtype=int)
+            for detection in np.flatnonzero(reused >= 0):
+                track = tracks[reused[detection]]
+                if not source_embeddings.shape[1]:
+                    source_embeddings = np.zeros((len(boxes), len(track["embedding"])), dtype=np.float32)
+                source_embeddings[detection] = track["embedding"]
+                sizes[detection] = track["size"]
+                ages[detection] = track["age"] + 1
+            if len(missing):
+                source_embeddings[missing] = features[offset:offset + len(missing)]
+                offset += len(missing)
+
+            self.stats["embedded"] += len(missing)
+            self.stats["reused"] += len(boxes) - len(missing)
+            self.pending[source_name] = (source_embeddings, sizes, ages)
+            embeddings[source_name] = source_embeddings
+        return embeddings
+
+    def remember(self, source_name: str, tracks):
+        """Cache the embeddings of the tracks a tracker output, (x1, y1, x2, y2, id, conf, cls, det_ind) rows, for the next frame."""
+        source_embeddings, sizes, ages = self.pending.pop(source_name, (None, None, None))
+        if source_embeddings is None:
+            return
+        self.tracks[source_name] = {int(track[4]): {"embedding": source_embeddings[int(track[7])], "box": track[:4].copy(),
+                                                    "size": sizes[int(track[7])], "age": ages[int(track[7])]}
+                                    for track in tracks}
+
+    def retain(self, sources_names):
+        """Forget the tracks of the sources that are not in `sources_names` anymore."""
+        for source_name in set(self.tracks.keys()) - set(sources_names):
+            del self.tracks[source_name]
@@ -0,0 +1,149 @@
+import os
+import re
+import json
+import fcntl
+import tempfile
+import threading
+from pathlib import Path
+from collections import Counter
+from time import time as curr_time, sleep
+
+from config import app_settings
+
+EXPIRE = re.compile(r"expire[=/](\d+)")
+
+
+def ytdlp_resolve(source: str):
+    """Media URL of a YouTube link (a googlevideo URL, or an HLS manifest for live streams) and its expiry, if known."""
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL({'quiet': True, 'format': 'best'}) as ydl:
+        media_url = ydl.extract_info(source, download=False)['url']
+    expire = EXPIRE.search(media_url)
+    return media_url, float(expire.group(1)) if expire else None
+
+def local_resolve(source: str):
+    """Stub resolver for tests and offline setups: the source is its own media URL."""
+    return source, None
+
+RESOLVERS = {"yt_dlp": ytdlp_resolve, "local": local_resolve}
+
+
+class SourceResolver:
+    """
+    Cache of resolved media URLs keyed by source URL. Entries keep their expiry (from the media URL, `default_ttl` otherwise),
+    are refreshed in the background `refresh_margin` seconds before it while a channel holds their source, and are shared
+    through a JSON file, so channels (and worker processes) start from cache instead of running an extraction.
+    `resolve_function(source) -> (media_url, expires_at or None)` is pluggable, see `RESOLVERS`.
+    """
+    def __init__(self, resolve_function=ytdlp_resolve, cache_path: str = None, default_ttl: float = 3600,
+                 refresh_margin: float = 300, refresh_interval: float = 60):
+        assert refresh_margin < default_ttl, ValueError("Refresh margin should be shorter than the default TTL")
+
+        self.resolve_function = resolve_function
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.default_ttl = default_ttl
+        self.refresh_margin = refresh_margin
+        self.refresh_interval = refresh_interval
+        self.entries = dict()  # source -> (media_url, expires_at)
+        self.active = Counter()  # source -> channels of this process holding it, the sources it keeps fresh
+        self.lock = threading.Lock()
+        self.refresher = None
+        self._load()
+
+    def _read(self) -> dict:
+        if not (self.cache_path and self.cache_path.exists()):
+            return dict()
+        with open(self.cache_path) as cache_file:
+            return json.load(cache_file)
+
+    def _merge(self, entries: dict):
+        with self.lock:
+            for source, entry in entries.items():
+                if source not in self.entries or entry[1] > self.entries[source][1]:
+                    self.entries[source] = tuple(entry)
+
+    def _load(self):
+        self._merge(self._read())
+
+    def _save(self, invalidated: tuple = None):
+        """
+        Merge the entries of this process into the cache file, under a file lock so that no process writes over the
+        entries another one just saved, `invalidated` (source, media_url) is dropped from it.
+        """
+        if not self.cache_path:
+            return
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_path.with_name(self.cache_path.name + ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = self._read()
+            if invalidated and invalidated[0] in entries and entries[invalidated[0]][0] == invalidated[1]:
+                del entries[invalidated[0]]
+            self._merge(entries)
+            with self.lock:
+                entries = dict(self.entries)
+            # Readers don't lock, they see the previous file or the new one, never a partial one
+            with tempfile.NamedTemporaryFile("w", dir=self.cache_path.parent, prefix=self.cache_path.name, suffix=".tmp", delete=False) as cache_file:
+                json.dump(entries, cache_file)
+            os.replace(cache_file.name, self.cache_path)
+
+    def _fresh(self, source: str, margin: float = 0):
+        entry = self.entries.get(source)
+        return entry[0] if entry and entry[1] - margin > curr_time() else None
+
+    def refresh(self, source: str) -> str:
+        """Resolve a source now and cache its media URL."""
+        media_url, expires_at = self.resolve_function(source)
+        with self.lock:
+            self.entries[source] = (media_url, expires_at or curr_time() + self.default_ttl)
+        self._save()
+        return media_url
+
+    def resolve(self, source: str) -> str:
+        """Media URL of a source, from cache while it is valid."""
+        media_url = self._fresh(source)
+        if media_url is None:
+            # Another process may have resolved it meanwhile
+            self._load()
+            media_url = self._fresh(source)
+        return media_url or self.refresh(source)
+
+    def hold(self, source: str):
+        """A channel of this process uses the source, its media URL is kept fresh until the channel releases it."""
+        self._start_refresher()
+        with self.lock:
+            self.active[source] += 1
+
+    def release(self, source: str):
+        with self.lock:
+            self.active[source] -= 1
+            if self.active[source] <= 0:
+                del self.active[source]
+
+    def invalidate(self, source: str):
+        """Forget the media URL of a source that failed to open or read, it is resolved again on next use."""
+        with self.lock:
+            entry = self.entries.pop(source, None)
+        self._save((source, entry[0]) if entry else None)
+
+    def _start_refresher(self):
+        with self.lock:
+            if self.refresher is None:
+                self.refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+                self.refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            with self.lock:
+                # Invalidated sources are resolved again by their reconnection
+                sources = [source for source in self.active.keys() if source in self.entries]
+            for source in sources:
+                if self._fresh(source, self.refresh_margin) is None:
+                    try:
+                        self.refresh(source)
+                    except Exception as e:
+                        print(f"❌ Resolving {source} failed: {e}")
+            sleep(self.refresh_interval)
+
+
+source_resolver = SourceResolver(RESOLVERS[app_settings.SOURCE_RESOLVER], app_settings.RESOLVER_CACHE_PATH)
@@ -0,0 +1,137 @@
+import numpy as np
+
+from .utils import box_iou
+
+
+def keyframe_positions(path: str):
+    """Frame indices of the keyframes of a file, its frames count and frame rate, read from its packets without decoding."""
+    import av
+
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        frame_rate = float(stream.average_rate or stream.guessed_rate or 25)
+        start = stream.start_time or 0
+        positions, count = [], 0
+        for packet in container.demux(stream):
+            # Flushing packets carry no data
+            if packet.pts is None:
+                continue
+            if packet.is_keyframe:
+                positions.append(round(float((packet.pts - start) * stream.time_base) * frame_rate))
+            count += 1
+    return sorted(positions), count, frame_rate
+
+def keyframe_segments(path: str, segments: int, overlap: float = 0, min_frames: int = 250):
+    """
+    Split a file into up to `segments` (start, end, stop) frame ranges starting at keyframes, so every segment seeks
+    exactly and decodes independently. A segment owns the frames from `start` to `end` and is analysed up to `stop`,
+    `overlap` seconds further (None is the end of the file). Segments shorter than `min_frames` are merged, a file
+    without keyframes (or without PyAV) is a single segment.
+    """
+    if segments <= 1:
+        return [(0, None, None)]
+    try:
+        keyframes, count, frame_rate = keyframe_positions(path)
+    except Exception as e:
+        print(f"❌ Splitting {path} failed, analysed in one segment: {e}")
+        return [(0, None, None)]
+    if not keyframes:
+        return [(0, None, None)]
+
+    keyframes = np.array(keyframes)
+    starts = [0]
+    for segment in range(1, segments):
+        # The keyframe nearest to the even split point
+        start = int(keyframes[np.abs(keyframes - segment * count / segments).argmin()])
+        if start - starts[-1] >= min_frames and count - start >= min_frames:
+            starts.append(start)
+    overlap = round(overlap * frame_rate)
+    return [(start, end, end + overlap if end else None) for start, end in zip(starts, starts[1:] + [None])]
+
+
+class TrackStitcher:
+    """
+    Relabel the tracker IDs of the segments of one file into a single ID space, as if it was tracked in one run.
+    Every segment but the last also analyses `overlap` frames past its end (its tail), which the next segment
+    analyses as its head: the next segment tracks are matched to the tail tracks by box IoU over those frames,
+    and inherit their IDs. A segment rows are held until the segment before it is done, then released relabelled
+    (`OfflineJob` hands them over with their frames already stored, as refs).
+    """
+    def __init__(self, segments: int, min_iou: float = 0.5):
+        self.min_iou = min_iou
+        self.next_id = 1
+        self.mappings = [dict() for _ in range(segments)]
+        self.tails = [list() for _ in range(segments)]
+        self.pending = [list() for _ in range(segments)]
+        self.done = [False] * segments
+        self.stitched = [segment == 0 for segment in range(segments)]
+
+    def _relabel(self, segment: int, rows: list) -> list:
+        mapping = self.mappings[segment]
+        for row in rows:
+            for box in row["boxes"]:
+                if box[6] is None:
+                    continue
+                if box[6] not in mapping:
+                    mapping[box[6]] = self.next_id
+                    self.next_id += 1
+                box[6] = mapping[box[6]]
+        return rows
+
+    def _stitch(self, segment: int):
+        """Map the head tracks of a segment to the tail tracks of the previous one, by IoU votes over the common frames."""
+        tail = {row["video_time"]: row["boxes"] for row in self._relabel(segment - 1, self.tails[segment - 1])}
+        votes = dict()
+        for row in self.pending[segment]:
+            tail_boxes = [box for box in tail.get(row["video_time"], []) if box[6] is not None]
+            head_boxes = [box for box in row["boxes"] if box[6] is not None]
+            if not tail_boxes or not head_boxes:
+                continue
+
+            iou = box_iou(np.array([box[:4] for box in head_boxes], dtype=np.float32), np.array([box[:4] for box in tail_boxes], dtype=np.float32))
+            iou[np.array([box[5] for box in head_boxes])[:, None] != np.array([box[5] for box in tail_boxes])[None, :]] = 0
+            # Greedy one to one matching per frame, best overlap first
+            while iou.size and iou.max() >= self.min_iou:
+                head, tail_index = np.unravel_index(iou.argmax(), iou.shape)
+                key = (head_boxes[head][6], tail_boxes[tail_index][6])
+                votes[key] = votes.get(key, 0) + 1
+                iou[head, :] = 0
+                iou[:, tail_index] = 0
+
+        mapping, used = self.mappings[segment], set()
+        for (head_id, tail_id), _ in sorted(votes.items(), key=lambda vote: -vote[1]):
+            if head_id not in mapping and tail_id not in used:
+                mapping[head_id] = tail_id
+                used.add(tail_id)
+        self.stitched[segment] = True
+        self.tails[segment - 1] = []
+
+    def _head_received(self, segment: int) -> bool:
+        tail = self.tails[segment - 1]
+        pending = self.pending[segment]
+        return self.done[segment] or not tail or (pending and pending[-1]["video_time"] >= tail[-1]["video_time"])
+
+    def _release(self) -> list:
+        """Stitch every segment whose previous one is stitched and done and whose head was received, release its held rows."""
+        rows = []
+        for segment in range(1, len(self.stitched)):
+            if not self.stitched[segment] and self.stitched[segment - 1] and self.done[segment - 1] and self._head_received(segment):
+                self._stitch(segment)
+                rows.extend(self._relabel(segment, self.pending[segment]))
+                self.pending[segment] = []
+        return rows
+
+    def push(self, segment: int, rows: list, tail: bool = False) -> list:
+        """Add rows of a segment, return the rows that can be written."""
+        if tail:
+            self.tails[segment].extend(rows)
+            return []
+        if not self.stitched[segment]:
+            self.pending[segment].extend(rows)
+            return self._release()
+        return self._relabel(segment, rows)
+
+    def finish(self, segment: int) -> list:
+        """Mark a segment done (or failed), return the rows of the segments it releases."""
+        self.done[segment] = True
+        return self._release()
@@ -0,0 +1,228 @@
+import re
+import cv2
+import numpy as np
+import requests
+from time import time
+from urllib.parse import urlparse
+from requests.auth import HTTPDigestAuth
+
+from .resolver import source_resolver
+
+def youtube_cap(source):
+    capture = cv2.VideoCapture(source_resolver.resolve(source))
+    if not capture.isOpened():
+        # The cached media URL may be stale, it is resolved again once
+        source_resolver.invalidate(source)
+        capture = cv2.VideoCapture(source_resolver.resolve(source))
+    return capture
+
+CONTENT_LENGTH = re.compile(rb"Content-Length:\s*(\d+)", re.IGNORECASE)
+
+class ThetaCap:
+    """
+    THETA camera live preview (multipart MJPEG over HTTP). The stream is parsed incrementally: chunks are appended to
+    a bytearray and scanned from where the previous scan stopped, using the part Content-Length when it is sent.
+    """
+    def __init__(self, url, chunk_size=1024 * 16, timeout=10):
+        parsed = urlparse(url)
+
+        try:
+            self.response = requests.post(
+                url=f"{parsed.scheme}://{parsed.hostname}{parsed.path}",
+                auth = HTTPDigestAuth(parsed.username, parsed.password),
+                json={"name": "camera.getLivePreview"},
+                headers={"Content-Type": "application/json;charset=utf-8"},
+                stream=True,
+                timeout=timeout
+            )
+            self.response.raise_for_status()
+            self.stream = self.response.iter_content(chunk_size=chunk_size)
+
+            self.buffer = bytearray()
+            self.scan_offset = 0
+            self.frame_start = -1
+            self.frame_length = None
+            self.last_timestamp = time()
+            self.fps_estimate = 0.0
+        except requests.RequestException as e:
+            print(f"Request failed: {e}")
+            self.response = None
+            self.stream = None
+
+    def _next_frame(self):
+        """Cut the next complete JPEG out of the buffer, None while it is not fully received."""
+        if self.frame_start < 0:
+            self.frame_start = self.buffer.find(b'\xff\xd8', self.scan_offset)
+            if self.frame_start < 0:
+                # A marker can be split between two chunks
+                self.scan_offset = max(0, len(self.buffer) - 1)
+                return None
+            length = CONTENT_LENGTH.search(self.buffer, 0, self.frame_start)
+            self.frame_length = int(length.group(1)) if length else None
+            self.scan_offset = self.frame_start + 2
+
+        if self.frame_length is not None:
+            end = self.frame_start + self.frame_length
+            if len(self.buffer) < end:
+                return None
+        else:
+            end = self.buffer.find(b'\xff\xd9', self.scan_offset)
+            if end < 0:
+                self.scan_offset = max(self.frame_start + 2, len(self.buffer) - 1)
+                return None
+            end += 2
+
+        frame = bytes(self.buffer[self.frame_start:end])
+        del self.buffer[:end]
+        self.scan_offset, self.frame_start, self.frame_length = 0, -1, None
+        return frame
+
+    def grab(self):
+        """Advance to the next frame without decoding, reading the stream until a whole frame is received."""
+        if not self.stream:
+            return False
+
+        while (frame := self._next_frame()) is None:
+            try:
+                chunk = next(self.stream)
+            except (StopIteration, requests.RequestException):
+                return False
+
+            if not chunk:
+                return False
+            self.buffer += chunk
+
+        self.jpg_data = frame
+        return True
+
+    def read(self):
+        """Get and decode the next frame."""
+        if self.grab():
+            frame = cv2.imdecode(np.frombuffer(self.jpg_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None:
+                self.fps_estimate = 1.0 / ((current_time := time()) - self.last_timestamp)
+                self.last_timestamp = current_time
+                return True, frame
+
+        return False, None
+
+    def release(self):
+        """Close the stream."""
+        if self.response:
+            self.response.close()
+            self.response = None
+            self.stream = None
+
+    def get(self, _):
+        """Return estimated frames per second."""
+        return round(self.fps_estimate, 2)
+
+class AVCap:
+    """
+    PyAV (FFmpeg) capture for files and RTSP streams, a drop-in for cv2.VideoCapture that can leave frames undecoded
+    (`skip_frames`: "nonref" skips non-reference frames, "nonkey" decodes keyframes only) and converts the decoded
+    frames straight to BGR at `decode_size` (longest side), so full resolution BGR frames are never materialized.
+    """
+    skip_modes = {"default": "DEFAULT", "nonref": "NONREF", "nonkey": "NONKEY"}
+
+    def __init__(self, source: str, skip_frames: str = "default", decode_size: int = None, rtsp_transport: str = "tcp",
+                 open_timeout: float = None):
+        import av
+
+        assert skip_frames in self.skip_modes.keys(), ValueError("Skip frames should be default, nonref or nonkey")
+
+        self.errors = (StopIteration, av.error.FFmpegError)
+        self.container = av.open(source, options={"rtsp_transport": rtsp_transport} if source.startswith("rtsp") else None, timeout=open_timeout)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        self.stream.codec_context.skip_frame = self.skip_modes[skip_frames]
+        self.decoded = self.container.decode(self.stream)
+
+        self.skip_frames = skip_frames
+        self.frame_rate = float(self.stream.average_rate or self.stream.guessed_rate or 0)
+        self.decoded_rate = self.frame_rate
+        self.frame = None
+        self.pending = None
+        self.first_time = None
+        self.last_time = None
+        self.intervals = 0
+
+        width, height = self.stream.codec_context.width, self.stream.codec_context.height
+        scale = min(1, decode_size / max(width, height)) if decode_size else 1
+        self.size = (max(2, round(width * scale / 2) * 2), max(2, round(height * scale / 2) * 2))
+
+    def grab(self):
+        """Decode the next frame without converting it."""
+        try:
+            if self.pending is not None:
+                self.frame, self.pending = self.pending, None
+            else:
+                self.frame = next(self.decoded)
+        except self.errors:
+            self.frame = None
+            return False
+
+        # Skipped frames lower the rate frames come out at: frames over the time they span, so uneven keyframe spacing averages out
+        if self.skip_frames != "default" and self.frame.time is not None:
+            if self.first_time is None:
+                self.first_time = self.frame.time
+            elif self.frame.time > self.last_time:
+                self.intervals += 1
+                self.decoded_rate = self.intervals / (self.frame.time - self.first_time)
+            self.last_time = self.frame.time
+        return True
+
+    def retrieve(self):
+        if self.frame is None:
+            return False, None
+        return True, self.frame.reformat(width=self.size[0], height=self.size[1], format="bgr24").to_ndarray()
+
+    def read(self):
+        return self.retrieve() if self.grab() else (False, None)
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return round(self.decoded_rate, 2)
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.stream.frames
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.size[0]
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.size[1]
+        return 0
+
+    def set(self, prop, value):
+        """Seek to a frame index (CAP_PROP_POS_FRAMES): from the keyframe before it, the frames up to it are decoded and dropped."""
+        if prop != cv2.CAP_PROP_POS_FRAMES or not self.frame_rate:
+            return False
+
+        start_time = float((self.stream.start_time or 0) * self.stream.time_base)
+        target = start_time + value / self.frame_rate
+        self.container.seek(int(target / self.stream.time_base), stream=self.stream, backward=True)
+        self.decoded = self.container.decode(self.stream)
+        self.pending, self.first_time, self.last_time, self.intervals = None, None, None, 0
+        for frame in self.decoded:
+            if frame.time is None or frame.time >= target - 0.5 / self.frame_rate:
+                self.pending = frame
+                break
+        return True
+
+    def release(self):
+        self.container.close()
+
+def open_capture(source: str, backend: str = "opencv", skip_frames: str = "default", decode_size: int = None, open_timeout: float = None):
+    """
+    Open a source by its kind: YouTube link, THETA camera live preview (http) or a file/stream read by cv2,
+    or by PyAV with the "av" backend (frame skipping and reduced size decoding).
+    `open_timeout` bounds how long opening and reading a stream can block.
+    """
+    if "youtu" in source:
+        return youtube_cap(source)
+    if "http" in source:
+        return ThetaCap(source, timeout=open_timeout or 10)
+    if backend == "av":
+        return AVCap(source, skip_frames, decode_size, open_timeout=open_timeout)
+    if open_timeout:
+        timeout = int(open_timeout * 1000)
+        return cv2.VideoCapture(source, cv2.CAP_ANY, [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, timeout, cv2.CAP_PROP_READ_TIMEOUT_MSEC, timeout])
+    return cv2.VideoCapture(source)
@@ -0,0 +1,202 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from .utils import box_iou
+
+# Constant velocity model over (cx, cy, aspect, height) and their velocities
+TRANSITION = np.eye(8, dtype=np.float64)
+TRANSITION[:4, 4:] = np.eye(4)
+PROJECTION = np.eye(4, 8, dtype=np.float64)
+
+
+def xyxy_to_xyah(boxes):
+    width, height = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+    return np.stack([boxes[:, 0] + width / 2, boxes[:, 1] + height / 2, width / np.maximum(height, 1e-6), height], axis=1)
+
+def xyah_to_xyxy(states):
+    width = states[:, 2] * states[:, 3]
+    return np.stack([states[:, 0] - width / 2, states[:, 1] - states[:, 3] / 2, states[:, 0] + width / 2, states[:, 1] + states[:, 3] / 2], axis=1)
+
+def match(cost, threshold: float):
+    """Optimal assignment of a cost matrix, pairs costing more than `threshold` are left unmatched."""
+    if not cost.size:
+        return np.empty((0, 2), dtype=int)
+    rows, cols = linear_sum_assignment(cost)
+    keep = cost[rows, cols] <= threshold
+    return np.stack([rows[keep], cols[keep]], axis=1)
+
+
+class BatchTracker:
+    """
+    ByteTrack-style tracker of every source of a channel at once, in NumPy: the Kalman states of all tracks are kept
+    in flat arrays and predicted/updated in single batched operations, only the (small) IoU assignment runs per source.
+    Detections above `high_threshold` are associated first, then the remaining tracks take the low confidence ones;
+    a new track is output from its second hit, and a lost track is kept `track_buffer` updates of its source.
+    With ReID embeddings, the first association also matches by appearance (BoT-SORT style): the cosine distance to the
+    track smoothed embedding replaces the IoU cost when under `appearance_threshold` and the boxes are near enough.
+    `update` takes and returns the boxmot formats: (x1, y1, x2, y2, conf, cls) rows in, (x1, y1, x2, y2, id, conf, cls, det_ind) out.
+    """
+    def __init__(self, high_threshold: float = 0.5, low_threshold: float = 0.1, new_track_threshold: float = 0.6,
+                 match_threshold: float = 0.8, track_buffer: int = 30, appearance_threshold: float = 0.25,
+                 proximity_threshold: float = 0.5, embedding_momentum: float = 0.9):
+        self.high_threshold = high_threshold
+        self.low_threshold = low_threshold
+        self.new_track_threshold = new_track_threshold
+        self.match_threshold = match_threshold
+        self.track_buffer = track_buffer
+        self.appearance_threshold = appearance_threshold
+        self.proximity_threshold = proximity_threshold
+        self.embedding_momentum = embedding_momentum
+
+        self.sources = dict()  # source_name -> {"index", "next_id"}
+        self.means = np.empty((0, 8))
+        self.covariances = np.empty((0, 8, 8))
+        self.track_sources = np.empty(0, dtype=int)
+        self.ids = np.empty(0, dtype=int)
+        self.hits = np.empty(0, dtype=int)
+        self.missed = np.empty(0, dtype=int)  # source updates since the track was last matched
+        self.features = None  # smoothed ReID embeddings, once some are given
+
+    def _noise(self, heights, position: float, velocity: float):
+        std = np.stack([position * heights, position * heights, np.full_like(heights, 1e-2), position * heights,
+                        velocity * heights, velocity * heights, np.full_like(heights, 1e-5), velocity * heights], axis=1)
+        return std ** 2
+
+    def _predict(self, tracks):
+        means, covariances = self.means[tracks], self.covariances[tracks]
+        # Lost tracks do not grow in height
+        means[self.missed[tracks] > 0, 7] = 0
+        noise = self._noise(means[:, 3], 1 / 20, 1 / 160)
+        self.means[tracks] = means @ TRANSITION.T
+        self.covariances[tracks] = TRANSITION @ covariances @ TRANSITION.T + noise[:, :, None] * np.eye(8)
+
+    def _update(self, tracks, measurements):
+        means, covariances = self.means[tracks], self.covariances[tracks]
+        noise = self._noise(means[:, 3], 1 / 20, 0)[:, :4]
+        projected_covariances = PROJECTION @ covariances @ PROJECTION.T + noise[:, :, None] * np.eye(4)
+        gains = np.linalg.solve(projected_covariances, (covariances @ PROJECTION.T).transpose(0, 2, 1)).transpose(0, 2, 1)
+        innovations = measurements - means[:, :4]
+        self.means[tracks] = means + (gains @ innovations[:, :, None])[:, :, 0]
+        self.covariances[tracks] = covariances - gains @ projected_covariances @ gains.transpose(0, 2, 1)
+
+    def _update_features(self, tracks, embeddings):
+        features = self.embedding_momentum * self.features[tracks] + (1 - self.embedding_momentum) * embeddings
+        self.features[tracks] = features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-6)
+
+    def _create(self, source_name: str, measurements, embeddings=None):
+        source = self.sources[source_name]
+        count = len(measurements)
+        means = np.zeros((count, 8))
+        means[:, :4] = measurements
+        std = np.stack([2 / 20 * measurements[:, 3], 2 / 20 * measurements[:, 3], np.full(count, 1e-2), 2 / 20 * measurements[:, 3],
+                        10 / 160 * measurements[:, 3], 10 / 160 * measurements[:, 3], np.full(count, 1e-5), 10 / 160 * measurements[:, 3]], axis=1)
+
+        self.means = np.concatenate([self.means, means])
+        self.covariances = np.concatenate([self.covariances, (std ** 2)[:, :, None] * np.eye(8)])
+        self.track_sources = np.concatenate([self.track_sources, np.full(count, source["index"])])
+        self.ids = np.concatenate([self.ids, np.arange(source["next_id"], source["next_id"] + count)])
+        self.hits = np.concatenate([self.hits, np.ones(count, dtype=int)])
+        self.missed = np.concatenate([self.missed, np.zeros(count, dtype=int)])
+        if self.features is not None:
+            self.features = np.concatenate([self.features, embeddings if embeddings is not None else np.zeros((count, self.features.shape[1]))])
+        source["next_id"] += count
+
+    def _keep(self, keep):
+        self.means, self.covariances = self.means[keep], self.covariances[keep]
+        self.track_sources, self.ids, self.hits, self.missed = self.track_sources[keep], self.ids[keep], self.hits[keep], self.missed[keep]
+        if self.features is not None:
+            self.features = self.features[keep]
+
+    def retain(self, sources_names):
+        """Drop the tracks of the sources that are not in `sources_names` anymore."""
+        for source_name in set(self.sources.keys()) - set(sources_names):
+            self._keep(self.track_sources != self.sources.pop(source_name)["index"])
+
+    def update(self, detections: dict, embeddings: dict = None) -> dict:
+        """
+        Update the tracks of the sources in `detections` ({source_name: (N, 6) rows}), the other sources are untouched.
+        `embeddings` optionally gives the ReID embeddings of those detections, {source_name: (N, D)}.
+        """
+        embeddings = {source_name: source_embeddings for source_name, source_embeddings in (embeddings or {}).items()
+                      if len(source_embeddings) and np.shape(source_embeddings)[1]}
+        if embeddings and self.features is None:
+            self.features = np.zeros((len(self.ids), next(iter(embeddings.values())).shape[1]))
+
+        for source_name in detections.keys():
+            if source_name not in self.sources:
+                self.sources[source_name] = {"index": max([source["index"] for source in self.sources.values()], default=-1) + 1, "next_id": 1}
+        indices = {source_name: self.sources[source_name]["index"] for source_name in detections.keys()}
+
+        updated = np.isin(self.track_sources, list(indices.values()))
+        self._predict(np.flatnonzero(updated))
+        boxes = xyah_to_xyxy(self.means[:, :4])
+
+        matched_tracks, matched_detections, matched_sources, created = [], [], [], dict()
+        matched_embeddings = []
+        for source_name, source_detections in detections.items():
+            source_detections = np.asarray(source_detections, dtype=np.float64).reshape(-1, 6)
+            tracks = np.flatnonzero(self.track_sources == indices[source_name])
+            confirmed = tracks[self.hits[tracks] > 1]
+            tentative = tracks[self.hits[tracks] == 1]
+            high = np.flatnonzero(source_detections[:, 4] >= self.high_threshold)
+            low = np.flatnonzero((source_detections[:, 4] >= self.low_threshold) & (source_detections[:, 4] < self.high_threshold))
+
+            # Confirmed (tracked and lost) tracks take the confident detections first
+            cost = 1 - box_iou(boxes[confirmed], source_detections[high, :4])
+            if source_name in embeddings:
+                appearance = np.clip(1 - self.features[confirmed] @ embeddings[source_name][high].T, 0, 2) / 2
+                appearance[(appearance > self.appearance_threshold) | (cost > self.proximity_threshold)] = 1
+                cost = np.minimum(cost, appearance)
+            pairs = match(cost, self.match_threshold)
+            source_tracks, source_matches = list(confirmed[pairs[:, 0]]), list(high[pairs[:, 1]])
+
+            # Then the tracks still tracked take the low confidence ones
+            rest = np.setdiff1d(confirmed, source_tracks)
+            rest = rest[self.missed[rest] == 0]
+            pairs = match(1 - box_iou(boxes[rest], source_detections[low, :4]), 0.5)
+            source_tracks += list(rest[pairs[:, 0]])
+            source_matches += list(low[pairs[:, 1]])
+
+            # New tracks are confirmed by a second confident detection
+            remaining = np.setdiff1d(high, source_matches)
+            pairs = match(1 - box_iou(boxes[tentative], source_detections[remaining, :4]), 0.7)
+            source_tracks += list(tentative[pairs[:, 0]])
+            source_matches += list(remaining[pairs[:, 1]])
+
+            remaining = np.setdiff1d(remaining, remaining[pairs[:, 1]])
+            created[source_name] = remaining[source_detections[remaining, 4] >= self.new_track_threshold]
+
+            matched_tracks += source_tracks
+            matched_detections += [source_detections[index] for index in source_matches]
+            matched_sources += [(source_name, index) for index in source_matches]
+            if source_name in embeddings:
+                matched_embeddings += [(len(matched_tracks) - len(source_tracks) + position, embeddings[source_name][index])
+                                       for position, index in enumerate(source_matches)]
+
+        matched_tracks = np.array(matched_tracks, dtype=int)
+        if len(matched_tracks):
+            self._update(matched_tracks, xyxy_to_xyah(np.array(matched_detections)[:, :4]))
+        if matched_embeddings:
+            positions = [position for position, _ in matched_embeddings]
+            self._update_features(matched_tracks[positions], np.array([embedding for _, embedding in matched_embeddings]))
+
+        # Matched tracks hit, the other tracks of the updated sources miss, tentative ones are dropped at once
+        missed = updated.copy()
+        missed[matched_tracks] = False
+        self.hits[matched_tracks] += 1
+        self.missed[matched_tracks] = 0
+        self.missed[missed] += 1
+
+        outputs = {source_name: [] for source_name in detections.keys()}
+        boxes = xyah_to_xyxy(self.means[matched_tracks, :4]) if len(matched_tracks) else np.empty((0, 4))
+        for track, box, detection, (source_name, index) in zip(matched_tracks, boxes, matched_detections, matched_sources):
+            outputs[source_name].append([*box, self.ids[track], detection[4], detection[5], index])
+
+        self._keep(~(missed & ((self.hits == 1) | (self.missed > self.track_buffer))))
+
+        for source_name, new_detections in created.items():
+            if len(new_detections):
+                self._create(source_name, xyxy_to_xyah(np.asarray(detections[source_name], dtype=np.float64).reshape(-1, 6)[new_detections, :4]),
+                             embeddings[source_name][new_detections] if source_name in embeddings else None)
+
+        return {source_name: np.array(rows, dtype=np.float64).reshape(-1, 8) for source_name, rows in outputs.items()}
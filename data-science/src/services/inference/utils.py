@@ -1,11 +1,8 @@
 import cv2
-import yt_dlp
 import numpy as np
 import torch
-import requests
-from time import time
-from urllib.parse import urlparse
-from requests.auth import HTTPDigestAuth
+import onnx
+from pathlib import Path
 
 def get_device():
     if not torch.cuda.is_available():
@@ -22,8 +19,18 @@ def get_device():
 
     return best_gpu
 
-def frame_resize(frame, target_size: int = 640):
-    original_height, original_width = frame.shape[:2]
+def is_dynamic_batch(model_path: str) -> bool:
+    """Check whether an exported model accepts a variable batch size, from the ONNX graph exported alongside it."""
+    onnx_path = Path(model_path).parent.parent / "onnx" / Path(model_path).with_suffix(".onnx").name
+    if not onnx_path.exists():
+        return False
+
+    model = onnx.load(str(onnx_path), load_external_data=False)
+    return bool(model.graph.input[0].type.tensor_type.shape.dim[0].dim_param)
+
+def letterbox_geometry(frame_shape, target_size: int = 640):
+    """Scale and offsets that fit a frame of `frame_shape` centered in a square of `target_size`."""
+    original_height, original_width = frame_shape[:2]
     aspect_ratio = original_width / original_height
 
     if aspect_ratio > 1:
@@ -33,101 +40,197 @@ def frame_resize(frame, target_size: int = 640):
         new_height = target_size
         new_width = int(target_size * aspect_ratio)
 
-    resized_frame = cv2.resize(frame, (new_width, new_height))
-    output_frame = np.zeros((target_size, target_size, 3), dtype=np.uint8)
-
     x_offset = (target_size - new_width) // 2
     y_offset = (target_size - new_height) // 2
 
-    output_frame[y_offset:y_offset + new_height, x_offset:x_offset + new_width] = resized_frame
+    return new_width / original_width, new_width, new_height, x_offset, y_offset
+
+def frame_resize(frame, target_size: int = 640, output_frame=None):
+    """Letterbox a frame, written directly into `output_frame` when given, whose borders must already be black."""
+    _, new_width, new_height, x_offset, y_offset = letterbox_geometry(frame.shape, target_size)
+
+    if output_frame is None:
+        output_frame = np.zeros((target_size, target_size, 3), dtype=np.uint8)
+
+    cv2.resize(frame, (new_width, new_height), dst=output_frame[y_offset:y_offset + new_height, x_offset:x_offset + new_width])
 
     # output_frame = cv2.flip(output_frame, 0)
     # output_frame = cv2.flip(output_frame, 1)
 
     return output_frame
 
-def reformat_box(box, models_names):
-    cls = str(int(box[-1]))
-    model_id, class_id = int(cls[0]), int(cls[1:])
-    x1, y1, x2, y2 = map(int, box[:4])
-    conf = round(float(box[-2]), 2)
-    label = models_names[model_id - 1][class_id]
-    track_id = int(box[-3]) if len(box) == 7 else None
-
-    return [x1, y1, x2, y2, conf, label, track_id]
-
-def youtube_cap(source):
-    with yt_dlp.YoutubeDL({'quiet': True, 'format': 'best'}) as ydl:
-        info = ydl.extract_info(source, download=False)
-        video_url = info['url']
-    return cv2.VideoCapture(video_url)
-
-class ThetaCap:
-    def __init__(self, url, chunk_size=1024 * 75):
-        parsed = urlparse(url)
-
-        try:
-            self.response = requests.post(
-                url=f"{parsed.scheme}://{parsed.hostname}{parsed.path}",
-                auth = HTTPDigestAuth(parsed.username, parsed.password),
-                json={"name": "camera.getLivePreview"},
-                headers={"Content-Type": "application/json;charset=utf-8"},
-                stream=True,
-                timeout=10
-            )
-            self.response.raise_for_status()
-            self.stream = self.response.iter_content(chunk_size=chunk_size)
-
-            self.buffer = b""
-            self.last_timestamp = time()
-            self.fps_estimate = 0.0
-        except requests.RequestException as e:
-            print(f"Request failed: {e}")
-            self.response = None
-            self.stream = None
-
-    def grab(self):
-        """Advance to the next frame without decoding."""
-        if not self.stream:
-            return False
-
-        try:
-            chunk = next(self.stream)
-        except StopIteration:
-            return False
-
-        if not chunk:
-            return False
-
-        self.buffer += chunk
-        start = self.buffer.find(b'\xff\xd8')
-        end = self.buffer.find(b'\xff\xd9')
-
-        if start != -1 and end != -1 and end > start:
-            self.jpg_data = self.buffer[start:end+2]
-            self.buffer = self.buffer[end+2:]
-            return True
-
-        return False
-
-    def read(self):
-        """Get and decode the next frame."""
-        if self.grab():
-            frame = cv2.imdecode(np.frombuffer(self.jpg_data, dtype=np.uint8), cv2.IMREAD_COLOR)
-            if frame is not None:
-                self.fps_estimate = 1.0 / ((current_time := time()) - self.last_timestamp)
-                self.last_timestamp = current_time
-                return True, frame
-
-        return False, None
-
-    def release(self):
-        """Close the stream."""
-        if self.response:
-            self.response.close()
-            self.response = None
-            self.stream = None
-
-    def get(self, _):
-        """Return estimated frames per second."""
-        return round(self.fps_estimate, 2)
\ No newline at end of file
+class LetterboxBuffers:
+    """
+    Preallocated letterbox outputs of one source, used in rotation so that frames still in flight
+    (queued between pipeline stages) are never overwritten. Borders are only cleared when the frame geometry changes.
+    """
+    def __init__(self, count: int = 2, target_size: int = 640):
+        self.target_size = target_size
+        self.buffers = [np.zeros((target_size, target_size, 3), dtype=np.uint8) for _ in range(count)]
+        self.geometries = [None] * count
+        self.index = 0
+
+    def letterbox(self, frame):
+        """Return the letterboxed frame and its (scale, x_offset, y_offset) mapping native coordinates to it."""
+        index, self.index = self.index, (self.index + 1) % len(self.buffers)
+        geometry = letterbox_geometry(frame.shape, self.target_size)
+        if self.geometries[index] != geometry:
+            self.buffers[index][:] = 0
+            self.geometries[index] = geometry
+
+        scale, _, _, x_offset, y_offset = geometry
+        return frame_resize(frame, self.target_size, self.buffers[index]), (scale, x_offset, y_offset)
+
+def letterbox_to_native(detections, letterbox):
+    """Map detection boxes from letterboxed coordinates back to the native frame resolution."""
+    scale, x_offset, y_offset = letterbox
+    native = detections.copy()
+    native[:, [0, 2]] = (native[:, [0, 2]] - x_offset) / scale
+    native[:, [1, 3]] = (native[:, [1, 3]] - y_offset) / scale
+    return native
+
+def tile_grid(frame_shape, rows: int, cols: int, overlap: float = 0.2):
+    """(x, y, width, height) of `rows` x `cols` tiles covering a frame, neighbour tiles overlapping by `overlap`."""
+    height, width = frame_shape[:2]
+    tile_width = int(width / (cols - (cols - 1) * overlap))
+    tile_height = int(height / (rows - (rows - 1) * overlap))
+    xs = np.linspace(0, width - tile_width, cols).astype(int)
+    ys = np.linspace(0, height - tile_height, rows).astype(int)
+    return [(x, y, tile_width, tile_height) for y in ys.tolist() for x in xs.tolist()]
+
+def tile_transform(tile, tile_letterbox, frame_letterbox):
+    """(scale, x_offset, y_offset) mapping coordinates in a letterboxed tile to the letterboxed full frame."""
+    tile_scale, tile_x_offset, tile_y_offset = tile_letterbox
+    frame_scale, frame_x_offset, frame_y_offset = frame_letterbox
+    scale = frame_scale / tile_scale
+    return (scale,
+            (tile[0] - tile_x_offset / tile_scale) * frame_scale + frame_x_offset,
+            (tile[1] - tile_y_offset / tile_scale) * frame_scale + frame_y_offset)
+
+def transform_points(points, transform):
+    """Apply a (scale, x_offset, y_offset) transform to an array of (x, y) points, None leaves them unchanged."""
+    if transform is None:
+        return points
+    scale, x_offset, y_offset = transform
+    return points * scale + np.array([x_offset, y_offset], dtype=np.float32)
+
+def transform_detections(detections, transform):
+    if transform is not None:
+        detections[:, :4] = transform_points(detections[:, :4].reshape(-1, 2), transform).reshape(-1, 4)
+    return detections
+
+def tiles_nms(detections, threshold: float = 0.6):
+    """
+    Greedy NMS over the boxes of all tiles of a frame, per model. Overlap is measured over the smaller box,
+    so an object cut by a tile border merges into its complete box from the neighbour tile. Returns kept row indices.
+    """
+    areas = (detections[:, 2] - detections[:, 0]) * (detections[:, 3] - detections[:, 1])
+    order = np.argsort(-detections[:, 4])
+    keep = []
+    while order.size:
+        index, rest = order[0], order[1:]
+        keep.append(index)
+
+        width = np.clip(np.minimum(detections[index, 2], detections[rest, 2]) - np.maximum(detections[index, 0], detections[rest, 0]), 0, None)
+        height = np.clip(np.minimum(detections[index, 3], detections[rest, 3]) - np.maximum(detections[index, 1], detections[rest, 1]), 0, None)
+        overlap = width * height / np.maximum(np.minimum(areas[index], areas[rest]), 1e-6)
+
+        order = rest[(overlap < threshold) | (detections[rest, 5] != detections[index, 5])]
+    return np.array(keep, dtype=int)
+
+def box_iou(boxes, others):
+    """Pairwise IoU matrix of two arrays of (x1, y1, x2, y2) boxes."""
+    width = np.clip(np.minimum(boxes[:, None, 2], others[None, :, 2]) - np.maximum(boxes[:, None, 0], others[None, :, 0]), 0, None)
+    height = np.clip(np.minimum(boxes[:, None, 3], others[None, :, 3]) - np.maximum(boxes[:, None, 1], others[None, :, 1]), 0, None)
+    intersection = width * height
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    other_areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    return intersection / np.maximum(areas[:, None] + other_areas[None, :] - intersection, 1e-6)
+
+def roi_rectangle(frame_shape, polygon):
+    """Pixel bounding rectangle (x1, y1, x2, y2) of a polygon given in normalized [0, 1] frame coordinates."""
+    height, width = frame_shape[:2]
+    points = np.asarray(polygon, dtype=np.float32) * [width, height]
+    x1, y1 = np.floor(points.min(axis=0)).astype(int)
+    x2, y2 = np.ceil(points.max(axis=0)).astype(int)
+    return max(int(x1), 0), max(int(y1), 0), min(max(int(x2), int(x1) + 1), width), min(max(int(y2), int(y1) + 1), height)
+
+def points_in_polygon(points, polygon):
+    """Ray casting test of many (x, y) points against one polygon, both as arrays."""
+    x, y = points[:, 0:1], points[:, 1:2]
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    crossing = ((y1 > y) != (y2 > y)) & (x < (x2 - x1) * (y - y1) / np.where(y2 == y1, 1e-9, y2 - y1) + x1)
+    return crossing.sum(axis=1) % 2 == 1
+
+def encode_frame(frame, quality: int = 80) -> bytes:
+    return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+def scene_thumbnail(frame, size: int = 64):
+    return cv2.cvtColor(cv2.resize(frame, (size, size), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+def scene_change_score(previous, current, pixel_threshold: int = 16) -> float:
+    """
+    Fraction of the thumbnail pixels that changed by more than `pixel_threshold` grey levels, from 0 (same scene) to 1.
+    Noise and compression artifacts stay under the threshold, a person walking in a wide shot changes about 1% of them.
+    """
+    if previous is None:
+        return 1.0
+    return round(float((cv2.absdiff(previous, current) > pixel_threshold).mean()), 4)
+
+# Columns of a detections array, one row per box
+DETECTION_COLUMNS = ("x1", "y1", "x2", "y2", "conf", "model_id", "class_id", "track_id")
+
+def empty_detections():
+    return np.empty((0, len(DETECTION_COLUMNS)), dtype=np.float32)
+
+def resolution_vote(detections, imgsz: int, frame_size: int = 640, small_object: int = 24, large_object: int = 96) -> int:
+    """
+    +1 when the input size should grow (small objects at `imgsz`, or nothing detected), -1 when every object
+    would still be larger than `large_object` pixels one step (32) lower, 0 otherwise.
+    """
+    if not len(detections):
+        return 1
+
+    sides = np.minimum(detections[:, 2] - detections[:, 0], detections[:, 3] - detections[:, 1]) / frame_size
+    if (sides * imgsz).min() < small_object:
+        return 1
+    if (sides * (imgsz - 32)).min() > large_object:
+        return -1
+    return 0
+
+def boxes_to_detections(boxes, model_id: int):
+    """Build detection rows from an ultralytics `Boxes` object without touching single boxes."""
+    detections = np.empty((len(boxes), len(DETECTION_COLUMNS)), dtype=np.float32)
+    detections[:, :4] = boxes.xyxy.cpu().numpy()
+    detections[:, 4] = boxes.conf.cpu().numpy()
+    detections[:, 5] = model_id
+    detections[:, 6] = boxes.cls.cpu().numpy()
+    detections[:, 7] = -1
+    return detections
+
+def tracks_to_detections(tracks, detections):
+    """Map tracker output rows (x1, y1, x2, y2, id, conf, cls, det_ind) back onto the detections they came from."""
+    tracked = detections[tracks[:, 7].astype(int)]
+    tracked[:, :4] = tracks[:, :4]
+    tracked[:, 7] = tracks[:, 4]
+    return tracked
+
+def build_labels(models_names: list):
+    """Flatten the class names of every model into one array, `labels[offsets[model_id] + class_id]` is the label."""
+    labels = [[names.get(class_id, str(class_id)) for class_id in range(max(names) + 1)] if names else [] for names in models_names]
+    offsets = np.cumsum([0] + [len(model_labels) for model_labels in labels[:-1]])
+    return np.array(sum(labels, []), dtype=object), offsets
+
+def format_detections(detections, labels, offsets) -> list:
+    """Convert detection rows to the published box format [x1, y1, x2, y2, conf, label, track_id]."""
+    if not len(detections):
+        return []
+
+    coordinates = detections[:, :4].astype(int).tolist()
+    confidences = np.round(detections[:, 4].astype(float), 2).tolist()
+    names = labels[offsets[detections[:, 5].astype(int)] + detections[:, 6].astype(int)].tolist()
+    track_ids = detections[:, 7].astype(int)
+    track_ids = np.where(track_ids >= 0, track_ids, None).tolist()
+
+    return [[*box, conf, label, track_id] for box, conf, label, track_id in zip(coordinates, confidences, names, track_ids)]
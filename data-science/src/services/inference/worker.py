@@ -0,0 +1,257 @@
+import asyncio
+import itertools
+import threading
+import multiprocessing
+from queue import Empty
+
+from .predictor import Predict
+from .pipeline import Pipeline
+from .model_pool import model_pool
+
+# Predict methods a channel can be configured with from the API process
+CONFIGURATIONS = ("configure_inference", "config_tracker", "configure_capture", "configure_output", "configure_resolution",
+                  "configure_tiling", "configure_roi", "configure_scheduler", "configure_motion_gate", "configure_reconnection")
+
+
+def _serve(commands, replies, results):
+    """Worker process loop: answer the API commands and run the hosted channels in turn between them."""
+    channels = dict()  # channel_name -> {"predictor", "pipeline", "running"}
+
+    def handle(command, name=None, *arguments):
+        if command == "start":
+            sources, models, configurations, pipeline_queue_size = arguments
+            predictor, pipeline = Predict(sources=sources, models=models), None
+            try:
+                for method, parameters in configurations:
+                    assert method in CONFIGURATIONS, ValueError(f"Unknown configuration {method}")
+                    getattr(predictor, method)(**parameters)
+
+                publisher = lambda data: results.put((name, data))
+                pipeline = Pipeline(predictor, publisher, queue_size=pipeline_queue_size) if pipeline_queue_size else None
+                if pipeline:
+                    pipeline.start()
+            except Exception:
+                # A channel that failed to start leaves no captures nor pooled models behind
+                if pipeline:
+                    pipeline.stop()
+                predictor.close()
+                raise
+            channels[name] = {"predictor": predictor, "pipeline": pipeline, "running": True}
+            return None
+
+        if command == "models_stats":
+            return model_pool.stats()
+
+        assert name in channels.keys(), KeyError(f"Channel {name} is not hosted by this worker")
+        channel = channels[name]
+
+        if command == "configure":
+            method, parameters = arguments
+            assert method in CONFIGURATIONS, ValueError(f"Unknown configuration {method}")
+            # The pipeline stages read the captures and the configuration in their own threads, it is paused meanwhile
+            pipeline = channel["pipeline"] if channel["running"] else None
+            if pipeline:
+                pipeline.stop()
+            try:
+                return getattr(channel["predictor"], method)(**parameters)
+            finally:
+                if pipeline:
+                    pipeline.start()
+
+        if command in ("pause", "resume"):
+            channel["running"] = command == "resume"
+            if channel["pipeline"]:
+                channel["pipeline"].start() if channel["running"] else channel["pipeline"].stop()
+            return None
+
+        if command == "end":
+            if channel["pipeline"]:
+                channel["pipeline"].stop()
+            channel["predictor"].close()
+            del channels[name]
+            return None
+
+        if command == "stats":
+            predictor = channel["predictor"]
+            if channel["pipeline"]:
+                return channel["pipeline"].stats()
+            return {"processing_rate": predictor.processing_rate, "schedule": predictor.schedule_stats()}
+
+        raise ValueError(f"Unknown command {command}")
+
+    while True:
+        # Block on the commands until a source of the channels run by this loop is due, `run()` never waits itself
+        running = [name for name, channel in channels.items() if channel["running"] and not channel["pipeline"]]
+        timeout = min([channels[name]["predictor"].next_wakeup() for name in running] + [0.1])
+        while True:
+            try:
+                command = commands.get(timeout=timeout) if timeout > 0 else commands.get_nowait()
+            except Empty:
+                break
+            timeout = 0
+
+            command_id, *command = command
+            if command[0] == "stop":
+                for channel in channels.values():
+                    if channel["pipeline"]:
+                        channel["pipeline"].stop()
+                    channel["predictor"].close()
+                return
+
+            try:
+                replies.put((command_id, True, handle(*command)))
+            except Exception as e:
+                replies.put((command_id, False, f"{type(e).__name__}: {e}"))
+            running = [name for name, channel in channels.items() if channel["running"] and not channel["pipeline"]]
+
+        for name in running:
+            try:
+                data = channels[name]["predictor"].run()
+                if data:
+                    results.put((name, data))
+            except Exception as e:
+                print(f"❌ Channel {name} error: {e}")
+
+
+class ChannelWorker:
+    """
+    A spawned process hosting one or more channels, so inference never blocks the API event loop and every
+    worker runs on its own core. Commands are answered by id, and the channels outputs come back as
+    (channel_name, data) over the results queue. One reader thread per worker hands both back to the event loop,
+    it takes at most `results_size` outputs ahead of their publishing, so a slow publisher slows the worker down.
+    Created from the event loop.
+    """
+    def __init__(self, name: str, results_size: int = 8, request_timeout: float = 120):
+        context = multiprocessing.get_context("spawn")
+        self.name = name
+        self.channels = set()
+        self.commands = context.Queue()
+        self.replies = context.Queue()
+        self.results = context.Queue(maxsize=results_size)
+        self.request_timeout = request_timeout
+        self.forwarder = None
+
+        self.loop = asyncio.get_running_loop()
+        self.pending = dict()  # command_id -> future of its reply
+        self.command_ids = itertools.count()
+        self.outputs = asyncio.Queue()
+        self.credits = threading.Semaphore(results_size)
+
+        self.process = context.Process(target=_serve, args=(self.commands, self.replies, self.results), name=f"channel-worker-{name}")
+        self.process.start()
+        self.reader = threading.Thread(target=self._read, name=f"channel-worker-{name}-reader", daemon=True)
+        self.reader.start()
+        print(f"✅ Worker {name} started (pid {self.process.pid})")
+
+    def _read(self):
+        """Reader thread: hand the replies and the outputs of the worker to the event loop, until the worker exits."""
+        try:
+            while self.process.is_alive():
+                try:
+                    while True:
+                        command_id, success, value = self.replies.get_nowait()
+                        self.loop.call_soon_threadsafe(self._reply, command_id, success, value)
+                except Empty:
+                    pass
+
+                if not self.credits.acquire(timeout=0.02):
+                    continue
+                try:
+                    output = self.results.get(timeout=0.02)
+                except Empty:
+                    self.credits.release()
+                    continue
+                self.loop.call_soon_threadsafe(self.outputs.put_nowait, output)
+            self.loop.call_soon_threadsafe(self._fail_pending)
+        except RuntimeError:
+            # The event loop is closed, nobody is waiting anymore
+            pass
+
+    def _reply(self, command_id: int, success: bool, value):
+        future = self.pending.pop(command_id, None)
+        # A reply that came after its timeout has nobody waiting for it
+        if future is None or future.done():
+            return
+        if success:
+            future.set_result(value)
+        else:
+            future.set_exception(RuntimeError(value))
+
+    def _fail_pending(self):
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(RuntimeError(f"Worker {self.name} is not running"))
+        self.pending.clear()
+
+    async def call(self, *command, timeout: float = None):
+        """Send a command and wait for its reply, errors raised by the worker are raised again here."""
+        if not self.process.is_alive():
+            raise RuntimeError(f"Worker {self.name} is not running")
+
+        command_id = next(self.command_ids)
+        future = self.pending[command_id] = self.loop.create_future()
+        self.commands.put((command_id, *command))
+        try:
+            return await asyncio.wait_for(future, timeout or self.request_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"Worker {self.name} did not answer {command[0]} in time")
+        finally:
+            self.pending.pop(command_id, None)
+
+    async def forward_results(self, publish):
+        """Hand every output of the worker to the `publish(channel_name, data)` coroutine, until it is cancelled."""
+        while True:
+            name, data = await self.outputs.get()
+            try:
+                await publish(name, data)
+            except Exception as e:
+                # One failed publishing (Kafka, database) must not stop the outputs of the worker
+                print(f"❌ Worker {self.name}: publishing {name} failed: {e}")
+            finally:
+                self.credits.release()
+
+    def stop(self):
+        self.commands.put((None, "stop"))
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.reader.join(timeout=1)
+        print(f"🛑 Worker {self.name} stopped")
+
+
+class ChannelWorkers:
+    """
+    Registry of the worker processes by group, a channel runs in the worker of its group (its own name by default).
+    The model pool lives in each worker: channels of one group share and batch their models, channels of different
+    groups run in parallel on their own cores with their own copies.
+    """
+    def __init__(self):
+        self.workers = dict()
+
+    def acquire(self, group: str, channel_name: str, publish) -> ChannelWorker:
+        if group not in self.workers:
+            worker = self.workers[group] = ChannelWorker(group)
+            worker.forwarder = asyncio.create_task(worker.forward_results(publish))
+
+        self.workers[group].channels.add(channel_name)
+        return self.workers[group]
+
+    async def release(self, worker: ChannelWorker, channel_name: str):
+        worker.channels.discard(channel_name)
+        if worker.channels:
+            return
+
+        for group, registered in list(self.workers.items()):
+            if registered is worker:
+                del self.workers[group]
+        await asyncio.to_thread(worker.stop)
+        worker.forwarder.cancel()
+
+    async def stop(self):
+        for worker in list(self.workers.values()):
+            await asyncio.to_thread(worker.stop)
+            worker.forwarder.cancel()
+        self.workers.clear()
+
+
+channel_workers = ChannelWorkers()